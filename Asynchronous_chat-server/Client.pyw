@@ -1,7 +1,9 @@
 import asyncio
+from collections import deque
 import tkinter as tk
 from tkinter import simpledialog
-import pickle
+
+from chatProtocol import readFrame, writeFrame
 
 
 class ChatClient:
@@ -52,6 +54,12 @@ class ChatClient:
         self.master.after(100, self.runAsyncioTasks)
 
         self.isUpdatingMessages = False
+        self.currentRoom = None
+        self.lastSeq = 0
+        self.knownLastSeq = 0
+        # Ответы приходят в порядке запросов, поэтому каждый запрос ждёт свою future из этой очереди.
+        self.pendingResponses = deque()
+        self.connected = False
 
     async def connectToServer(self):
         try:
@@ -61,8 +69,83 @@ class ChatClient:
             self.joinRoomButton.config(state=tk.NORMAL)
         except ConnectionError:
             print("Не удалось подключиться к серверу.")
-        
-        self.loop.create_task(self.fetchRooms())
+            return
+
+        self.connected = True
+        self.loop.create_task(self.readFrames())
+        self.startTask(self.subscribeRooms())
+
+    def startTask(self, coroutine):
+        self.loop.create_task(coroutine).add_done_callback(self.taskDone)
+
+    def taskDone(self, task):
+        # После обрыва связи запросы завершаются ConnectionError, а сам обрыв уже показан; прочие ошибки печатаются,
+        # чтобы не потеряться в задаче.
+        if not task.cancelled() and task.exception() is not None and not isinstance(task.exception(), ConnectionError):
+            print(f"Ошибка: {task.exception()!r}")
+
+    async def request(self, request, onResponse=None):
+        # onResponse вызывается прямо при чтении ответа, до разбора следующих кадров,
+        # то есть раньше любого события, отправленного сервером после этого ответа.
+        if not self.connected:
+            raise ConnectionError("Нет соединения с сервером.")
+
+        response = self.loop.create_future()
+        entry = (response, onResponse)
+        self.pendingResponses.append(entry)
+        try:
+            await writeFrame(self.writer, request)
+        except Exception:
+            # Неотправленный запрос не получит ответа, и его future сдвинула бы очередь для всех следующих.
+            if entry in self.pendingResponses:
+                self.pendingResponses.remove(entry)
+            raise
+        return await response
+
+    async def readFrames(self):
+        # Между ответами сервер в любой момент присылает события подписок, их отличает поле event.
+        try:
+            while True:
+                frame = await readFrame(self.reader)
+                if "event" in frame:
+                    self.handleEvent(frame)
+                else:
+                    response, onResponse = self.pendingResponses.popleft()
+                    try:
+                        if onResponse is not None:
+                            onResponse(frame)
+                    except Exception as e:
+                        response.set_exception(e)
+                    else:
+                        response.set_result(frame)
+        except (asyncio.IncompleteReadError, ConnectionError):
+            print("Соединение с сервером потеряно.")
+        finally:
+            # Ответов на отправленные запросы уже не будет: ждущие их корутины завершаются ошибкой, а не висят.
+            self.connected = False
+            self.createRoomButton.config(state=tk.DISABLED)
+            self.joinRoomButton.config(state=tk.DISABLED)
+            while self.pendingResponses:
+                response, _ = self.pendingResponses.popleft()
+                if not response.done():
+                    response.set_exception(ConnectionError("Соединение с сервером потеряно."))
+
+    def handleEvent(self, event):
+        kind = event["event"]
+        if kind == "message" and event["room"] == self.currentRoom:
+            self.knownLastSeq = max(self.knownLastSeq, event["seq"])
+            self.appendMessages([(event["seq"], event["user"], event["message"])])
+            if self.lastSeq < self.knownLastSeq:
+                self.startTask(self.updateMessages())
+        elif kind == "room_created":
+            self.roomList.insert(tk.END, event["room"])
+        elif kind == "resync":
+            # Сервер пропустил часть событий из-за переполненной очереди: список комнат перечитывается целиком,
+            # а из комнаты дочитываются только сообщения после последнего показанного.
+            if event["roomList"]:
+                self.startTask(self.fetchRooms())
+            if self.currentRoom in event["rooms"]:
+                self.startTask(self.updateMessages())
 
     def runAsyncioTasks(self):
         try:
@@ -73,94 +156,109 @@ class ChatClient:
         finally:
             self.master.after(100, self.runAsyncioTasks)
 
-    def updateRoomList(self):
-        self.loop.create_task(self.fetchRooms())
+    async def subscribeRooms(self):
+        data = await self.request({"action": "subscribe"})
+        self.showRooms(data.get("rooms", []))
 
     async def fetchRooms(self):
         request = {"action": "get_rooms"}
-        self.writer.write(pickle.dumps(request))
-        await self.writer.drain()
+        data = await self.request(request)
+        self.showRooms(data.get("rooms", []))
 
-        response = await self.reader.read(1024)
-        if response:
-            data = pickle.loads(response)
-            rooms = data.get("rooms", [])
-            self.roomList.delete(0, tk.END)
-            for room in rooms:
-                self.roomList.insert(tk.END, room)
+    def showRooms(self, rooms):
+        self.roomList.delete(0, tk.END)
+        for room in rooms:
+            self.roomList.insert(tk.END, room)
 
     def createRoom(self):
         roomName = simpledialog.askstring("Новая комната", "Введите название комнаты:")
         if roomName:
             print(f"Создание новой комнаты: {roomName}")
-            self.loop.create_task(self.sendCreateRoomRequest(roomName))
+            self.startTask(self.sendCreateRoomRequest(roomName))
 
     async def sendCreateRoomRequest(self, roomName):
         request = {"action": "create_room", "room": roomName}
-        self.writer.write(pickle.dumps(request))
-        await self.writer.drain()
-
-        response = await self.reader.read(1024)
-        if response:
-            data = pickle.loads(response)
-            if data.get("status") == "room_created":
-                print(f"Комната '{roomName}' создана.")
-                self.updateRoomList()
+        data = await self.request(request)
+        if data.get("status") == "room_created":
+            print(f"Комната '{roomName}' создана.")
 
     def joinRoom(self):
         selectedRoom = self.roomList.get(tk.ACTIVE)
         if selectedRoom:
+            previousRoom = self.currentRoom
             self.currentRoom = selectedRoom
             self.roomLabel.config(text=f"Текущая комната: {self.currentRoom}")
-            self.messageBox.config(state=tk.NORMAL)
-            self.messageBox.delete(1.0, tk.END)
-            self.messageBox.config(state=tk.DISABLED)
-            self.loop.create_task(self.updateMessages())
+            self.lastSeq = self.knownLastSeq = 0
+            self.showMessages([])
+            self.startTask(self.subscribeRoom(previousRoom, selectedRoom))
+
+    async def subscribeRoom(self, previousRoom, room):
+        if previousRoom:
+            await self.request({"action": "unsubscribe", "room": previousRoom})
+
+        # Последние сообщения приходят в ответе на подписку, дальше новые сообщения присылает сам сервер.
+        await self.request({"action": "subscribe", "room": room},
+                           lambda data: self.showRoomPage(room, data) if room == self.currentRoom else None)
+
+    def showRoomPage(self, room, data):
+        messages = data.get("messages", [])
+        self.lastSeq = messages[0][0] - 1 if messages else data.get("lastSeq", 0)
+        self.knownLastSeq = data.get("lastSeq", 0)
+        self.showMessages(messages)
 
     async def updateMessages(self):
         if self.isUpdatingMessages:
             return
         self.isUpdatingMessages = True
 
+        # Дочитываются только сообщения после последнего показанного, страницами, пока не догоним сервер.
         try:
-            if self.currentRoom:
-                request = {"action": "get_messages", "room": self.currentRoom}
-                self.writer.write(pickle.dumps(request))
-                await self.writer.drain()
-
-                response = await self.reader.read(1024)
-                if response:
-                    data = pickle.loads(response)
-                    messages = data.get("messages", [])
-
-                    self.messageBox.config(state=tk.NORMAL)
-                    self.messageBox.delete(1.0, tk.END)
-                    for user, msg in messages:
-                        self.messageBox.insert(tk.END, f"{user}: {msg}\n")
-                    self.messageBox.config(state=tk.DISABLED)
-                    self.messageBox.see(tk.END)
+            while self.currentRoom:
+                room = self.currentRoom
+                request = {"action": "get_messages", "room": room, "since": self.lastSeq}
+                data = await self.request(request)
+                if room != self.currentRoom:
+                    break
+
+                messages = data.get("messages", [])
+                self.knownLastSeq = max(self.knownLastSeq, data.get("lastSeq", 0))
+                self.appendMessages(messages)
+                if not messages or self.lastSeq >= self.knownLastSeq:
+                    break
 
         finally:
             self.isUpdatingMessages = False
 
-        self.master.after(100, lambda: self.loop.create_task(self.updateMessages()))
+    def showMessages(self, messages):
+        self.messageBox.config(state=tk.NORMAL)
+        self.messageBox.delete(1.0, tk.END)
+        self.messageBox.config(state=tk.DISABLED)
+        self.appendMessages(messages)
+
+    def appendMessages(self, messages):
+        # Номера сообщений в комнате идут подряд: повторы пропускаются, на разрыве показ останавливается.
+        self.messageBox.config(state=tk.NORMAL)
+        for seq, user, msg in messages:
+            if seq <= self.lastSeq:
+                continue
+            if seq > self.lastSeq + 1:
+                break
+            self.messageBox.insert(tk.END, f"{user}: {msg}\n")
+            self.lastSeq = seq
+        self.messageBox.config(state=tk.DISABLED)
+        self.messageBox.see(tk.END)
 
     def sendMessage(self, event=None):
         message = self.inputMessage.get()
         if self.currentRoom and message:
-            self.loop.create_task(self.sendChatMessage(message))
+            self.startTask(self.sendChatMessage(message))
             self.inputMessage.delete(0, tk.END)
 
     async def sendChatMessage(self, message):
         request = {"action": "send_message", "room": self.currentRoom, "user": self.username, "message": message}
-        self.writer.write(pickle.dumps(request))
-        await self.writer.drain()
-
-        response = await self.reader.read(1024)
-        if response:
-            data = pickle.loads(response)
-            if data.get("status") == "message_sent":
-                await self.updateMessages()
+        data = await self.request(request)
+        if data.get("status") != "message_sent":
+            print(f"Сообщение не отправлено: {data.get('status')}")
 
 
 if __name__ == "__main__":
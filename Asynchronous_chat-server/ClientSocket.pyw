@@ -1,7 +1,8 @@
 import socket
 import tkinter as tk
 from tkinter import simpledialog
-import pickle
+
+from chatProtocol import FrameConnection
 
 class ChatClient:
     def __init__(self, master):
@@ -10,6 +11,7 @@ class ChatClient:
         
         self.socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
         self.socket.connect(("localhost", 5555))
+        self.connection = FrameConnection(self.socket)
         
         self.username = simpledialog.askstring("Username", "Enter your name:")
         
@@ -56,9 +58,7 @@ class ChatClient:
     
     def updateRoomList(self):
         request = {"action": "get_rooms", "user": self.username}
-        self.socket.send(pickle.dumps(request))
-        
-        response = pickle.loads(self.socket.recv(1024))
+        response = self.connection.request(request)
         rooms = response.get("rooms", [])
         
         self.roomList.delete(0, tk.END)
@@ -71,8 +71,7 @@ class ChatClient:
         roomName = simpledialog.askstring("New Room", "Enter room name:")
         if roomName:
             request = {"action": "create_room", "room": roomName}
-            self.socket.send(pickle.dumps(request))
-            response = pickle.loads(self.socket.recv(1024))
+            response = self.connection.request(request)
             if response.get("status") == "room_created":
                 self.updateRoomList()
 
@@ -80,8 +79,7 @@ class ChatClient:
         targetUser = simpledialog.askstring("Private Room", "Enter the username of the person to chat privately with:")
         if targetUser:
             request = {"action": "create_private_room", "user": self.username, "target_user": targetUser}
-            self.socket.send(pickle.dumps(request))
-            response = pickle.loads(self.socket.recv(1024))
+            response = self.connection.request(request)
             private_room_name = response.get("room_name")
             if response.get("status") == "private_room_created":
                 self.currentRoom = private_room_name
@@ -102,8 +100,7 @@ class ChatClient:
     def updateMessages(self):
         if self.currentRoom:
             request = {"action": "get_messages", "room": self.currentRoom, "user": self.username}
-            self.socket.send(pickle.dumps(request))
-            response = pickle.loads(self.socket.recv(1024))
+            response = self.connection.request(request)
             messages = response.get("messages", [])
             
             self.messageBox.config(state=tk.NORMAL)
@@ -118,8 +115,7 @@ class ChatClient:
         message = self.inputMessage.get()
         if self.currentRoom and message:
             request = {"action": "send_message", "room": self.currentRoom, "user": self.username, "message": message}
-            self.socket.send(pickle.dumps(request))
-            response = pickle.loads(self.socket.recv(1024))
+            response = self.connection.request(request)
             if response.get("status") == "message_sent":
                 self.inputMessage.delete(0, tk.END)
                 self.updateMessages()
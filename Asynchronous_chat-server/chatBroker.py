@@ -0,0 +1,131 @@
+import asyncio
+import os
+import signal
+from collections import deque
+
+from chatProtocol import encodeFrame, readFrame
+from historyStore import HistoryService, HistoryStore, flushPeriodically
+
+historyFlushInterval = 1.0
+
+class Broker:
+    # Единственный владелец истории в режиме нескольких воркеров: выполняет их запросы по очереди
+    # и рассылает события всем воркерам, а те уже раздают их своим подписчикам. Событие уходит
+    # воркерам раньше ответа на запрос, который его вызвал.
+    def __init__(self, historyPath):
+        self.history = HistoryStore(historyPath)
+        self.service = HistoryService(self.history, self.broadcast)
+        self.workers = set()
+
+    def broadcast(self, event):
+        # Событие вызвано уже выполненным запросом, поэтому сбой его кодирования не должен превращать ответ в ошибку.
+        try:
+            frame = encodeFrame(event)
+        except Exception as e:
+            print(f"Событие {event.get('event')!r} не разослано: {e!r}")
+            return
+        for writer in self.workers:
+            writer.write(frame)
+
+    async def handleWorker(self, reader, writer):
+        self.workers.add(writer)
+        try:
+            while True:
+                try:
+                    request = await readFrame(reader)
+                except asyncio.IncompleteReadError:
+                    break
+                # Ошибка одного запроса не должна рвать связь с воркером: иначе он отключил бы всех своих клиентов.
+                try:
+                    response = self.service.execute(request)
+                except Exception as e:
+                    print(f"Ошибка запроса {request.get('action')!r}: {e!r}")
+                    response = {"status": "server_error"}
+                # Воркер сопоставляет ответы с запросами по порядку, так что ответ уходит на каждый запрос,
+                # даже если сам его не удалось закодировать.
+                try:
+                    frame = encodeFrame(response)
+                except Exception as e:
+                    print(f"Ответ на запрос {request.get('action')!r} не закодирован: {e!r}")
+                    frame = encodeFrame({"status": "server_error"})
+                writer.write(frame)
+                await writer.drain()
+        except ConnectionError:
+            pass
+        finally:
+            self.workers.discard(writer)
+            writer.close()
+
+    async def serve(self, brokerPath):
+        if os.path.exists(brokerPath):
+            os.unlink(brokerPath)
+        server = await asyncio.start_unix_server(self.handleWorker, brokerPath)
+        flushTask = asyncio.create_task(flushPeriodically(self.history, historyFlushInterval))
+
+        try:
+            async with server:
+                await server.serve_forever()
+        finally:
+            flushTask.cancel()
+            self.history.close()
+            if os.path.exists(brokerPath):
+                os.unlink(brokerPath)
+
+def runBroker(brokerPath, historyPath):
+    # SIGTERM от главного процесса завершает брокер так же, как Ctrl+C, с записью хвоста истории на диск.
+    signal.signal(signal.SIGTERM, signal.default_int_handler)
+    try:
+        asyncio.run(Broker(historyPath).serve(brokerPath))
+    except KeyboardInterrupt:
+        pass
+
+class BrokerClient:
+    # Соединение воркера с брокером. Ответы приходят в порядке запросов, события рассылки — между ними.
+    def __init__(self, onEvent):
+        self.onEvent = onEvent
+        self.pendingResponses = deque()
+
+    async def connect(self, brokerPath, attempts=50):
+        for _ in range(attempts):
+            try:
+                self.reader, self.writer = await asyncio.open_unix_connection(brokerPath)
+                break
+            except (FileNotFoundError, ConnectionRefusedError):
+                await asyncio.sleep(0.1)
+        else:
+            raise ConnectionError(f"Брокер {brokerPath} недоступен.")
+
+        self.readerTask = asyncio.create_task(self.readFrames())
+
+    async def request(self, request, onResponse=None):
+        # onResponse вызывается прямо при чтении ответа, раньше любого события, разосланного брокером после него.
+        # Запрос кодируется до постановки в очередь: future запроса, который не ушёл брокеру, осталась бы
+        # в её начале и забирала бы чужие ответы.
+        frame = encodeFrame(request)
+        response = asyncio.get_running_loop().create_future()
+        self.pendingResponses.append((response, onResponse))
+        self.writer.write(frame)
+        await self.writer.drain()
+        return await response
+
+    async def readFrames(self):
+        try:
+            while True:
+                frame = await readFrame(self.reader)
+                if "event" in frame:
+                    self.onEvent(frame)
+                else:
+                    response, onResponse = self.pendingResponses.popleft()
+                    try:
+                        if onResponse is not None:
+                            onResponse(frame)
+                    except Exception as e:
+                        response.set_exception(e)
+                    else:
+                        response.set_result(frame)
+        except (asyncio.IncompleteReadError, ConnectionError):
+            print("Соединение с брокером потеряно.")
+        finally:
+            for response, _ in self.pendingResponses:
+                if not response.done():
+                    response.set_exception(ConnectionError("Соединение с брокером потеряно."))
@@ -0,0 +1,540 @@
+import argparse
+import asyncio
+import json
+import multiprocessing
+import os
+import random
+import resource
+import signal
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from collections import deque
+
+from chatProtocol import ProtocolError, readFrame, writeFrame
+
+serverScripts = {"asyncio": "server.py", "threads": "serverSocket.py"}
+# server.py присылает новые сообщения подписчикам сам, а serverSocket.py клиенты опрашивают get_messages.
+deliveryModes = {"asyncio": "push", "threads": "poll"}
+actions = ("create_room", "send_message", "get_messages", "get_rooms")
+maxSamples = 100000
+barrierTimeout = 600
+
+class StepStats:
+    def __init__(self):
+        self.requests = {action: 0 for action in actions}
+        self.requestLatencies = {action: [] for action in actions}
+        self.requestSampleCounts = {action: 0 for action in actions}
+        self.deliveryLatencies = []
+        self.deliverySampleCount = 0
+        self.messagesSent = 0
+        self.deliveries = 0
+        self.errors = 0
+        self.timeouts = 0
+        self.connectErrors = 0
+
+    def addSample(self, samples, seenCount, value):
+        # Выборка ограничена резервуаром, чтобы память генератора не росла с длиной шага.
+        if len(samples) < maxSamples:
+            samples.append(value)
+        else:
+            index = random.randrange(seenCount)
+            if index < maxSamples:
+                samples[index] = value
+
+    def addRequest(self, action, seconds):
+        self.requests[action] += 1
+        self.requestSampleCounts[action] += 1
+        self.addSample(self.requestLatencies[action], self.requestSampleCounts[action], seconds)
+
+    def addDelivery(self, seconds):
+        self.deliveries += 1
+        self.deliverySampleCount += 1
+        self.addSample(self.deliveryLatencies, self.deliverySampleCount, seconds)
+
+class LoadSession:
+    # Подобие ChatClient: одно соединение, запросы по очереди, ответы сопоставляются с запросами по порядку,
+    # а события подписок приходят между ними.
+    def __init__(self, generator, sessionIndex):
+        self.generator = generator
+        self.arguments = generator.arguments
+        self.sessionIndex = sessionIndex
+        self.user = f"user{sessionIndex}"
+        self.room = f"room{sessionIndex % self.arguments.rooms}"
+        self.pendingResponses = deque()
+        self.seenMessages = 0
+        self.createdRooms = 0
+        self.alive = False
+
+    async def connect(self):
+        self.reader, self.writer = await asyncio.wait_for(
+            asyncio.open_connection(self.arguments.host, self.arguments.port), self.arguments.timeout)
+        self.alive = True
+        self.readerTask = asyncio.create_task(self.readFrames())
+
+        if self.generator.delivery == "push":
+            await self.request({"action": "subscribe"})
+            await self.request({"action": "subscribe", "room": self.room, "limit": 1})
+        else:
+            response = await self.request({"action": "get_messages", "room": self.room, "user": self.user})
+            self.seenMessages = len(response.get("messages", []))
+
+    async def request(self, request):
+        response = asyncio.get_running_loop().create_future()
+        self.pendingResponses.append(response)
+        await writeFrame(self.writer, request)
+        return await asyncio.wait_for(response, self.arguments.timeout)
+
+    async def readFrames(self):
+        try:
+            while True:
+                frame = await readFrame(self.reader)
+                if "event" in frame:
+                    if frame["event"] == "message" and frame["user"] != self.user:
+                        self.recordDelivery(frame["message"])
+                else:
+                    self.pendingResponses.popleft().set_result(frame)
+        except (asyncio.IncompleteReadError, ConnectionError, ProtocolError, IndexError):
+            pass
+        finally:
+            self.alive = False
+            for response in self.pendingResponses:
+                if not response.done():
+                    response.set_exception(ConnectionError("Сервер закрыл соединение."))
+
+    def recordDelivery(self, message):
+        # Время отправки едет в самом тексте сообщения, генераторы на одной машине делят часы time.time.
+        if message.startswith("load|"):
+            self.generator.stats.addDelivery(time.time() - float(message.split("|", 2)[1]))
+
+    def collectPolledMessages(self, messages):
+        newMessages = messages[self.seenMessages:]
+        self.seenMessages = len(messages)
+        for user, message in newMessages:
+            if user != self.user:
+                self.recordDelivery(message)
+
+    def nextRequest(self):
+        action = random.choices(actions, self.generator.actionWeights)[0]
+        if action == "create_room":
+            self.createdRooms += 1
+            return {"action": action, "room": f"extra{self.sessionIndex}_{self.createdRooms}"}
+        if action == "send_message":
+            message = f"load|{time.time():.6f}|".ljust(self.arguments.messageSize, "x")
+            return {"action": action, "room": self.room, "user": self.user, "message": message}
+        if action == "get_messages":
+            return {"action": action, "room": self.room, "user": self.user, "limit": 1}
+        return {"action": action, "user": self.user}
+
+    async def perform(self, request):
+        startTime = time.perf_counter()
+        try:
+            response = await self.request(request)
+        except asyncio.TimeoutError:
+            # После тайм-аута ответы уже не сопоставить с запросами, поэтому сессия закрывается.
+            self.generator.stats.timeouts += 1
+            self.close()
+            return
+        except (ConnectionError, OSError):
+            self.generator.stats.errors += 1
+            self.close()
+            return
+
+        stats = self.generator.stats
+        stats.addRequest(request["action"], time.perf_counter() - startTime)
+        if request["action"] == "send_message":
+            stats.messagesSent += 1
+            if response.get("status") != "message_sent":
+                stats.errors += 1
+        elif request["action"] == "get_messages" and self.generator.delivery == "poll":
+            self.collectPolledMessages(response.get("messages", []))
+
+    async def run(self):
+        nextPoll = time.monotonic() + random.uniform(0, self.arguments.pollInterval)
+        while self.alive:
+            # Паузы между действиями экспоненциальные, так что сессии не ходят на сервер строем.
+            delay = random.expovariate(self.arguments.rate)
+            if self.generator.delivery == "poll":
+                delay = min(delay, max(nextPoll - time.monotonic(), 0))
+            await asyncio.sleep(delay)
+            if not self.alive:
+                break
+
+            if self.generator.delivery == "poll" and time.monotonic() >= nextPoll:
+                # Опрос, не успевший вовремя, не догоняется пачкой, как и у ChatClient с after().
+                nextPoll = time.monotonic() + self.arguments.pollInterval
+                await self.perform({"action": "get_messages", "room": self.room, "user": self.user})
+            else:
+                await self.perform(self.nextRequest())
+
+    def close(self):
+        self.alive = False
+        self.writer.close()
+
+class LoadGenerator:
+    def __init__(self, arguments, processIndex):
+        self.arguments = arguments
+        self.processIndex = processIndex
+        self.delivery = deliveryModes[arguments.server]
+        self.actionWeights = [arguments.mix[action] for action in actions]
+        self.stats = StepStats()
+        self.sessions = []
+        self.sessionTasks = []
+        self.openedCount = 0
+
+    async def openSessions(self, targetCount):
+        connectLimit = asyncio.Semaphore(self.arguments.connectConcurrency)
+
+        async def openSession(sessionIndex):
+            session = LoadSession(self, sessionIndex)
+            async with connectLimit:
+                try:
+                    await session.connect()
+                except (asyncio.TimeoutError, ConnectionError, OSError):
+                    self.stats.connectErrors += 1
+                    if session.alive:
+                        session.close()
+                    return
+            self.sessions.append(session)
+            self.sessionTasks.append(asyncio.create_task(session.run()))
+
+        # Сессии процессов нумеруются вперемешку, чтобы комнаты и имена не пересекались.
+        firstIndex, self.openedCount = self.openedCount, max(targetCount, self.openedCount)
+        await asyncio.gather(*(openSession(index * self.arguments.processes + self.processIndex)
+                               for index in range(firstIndex, targetCount)))
+
+    def aliveCount(self):
+        return sum(session.alive for session in self.sessions)
+
+    async def closeSessions(self):
+        for session in self.sessions:
+            if session.alive:
+                session.close()
+        for task in self.sessionTasks:
+            task.cancel()
+        await asyncio.gather(*self.sessionTasks, return_exceptions=True)
+
+async def runGenerator(arguments, processIndex, sessionCounts, barriers, results, stopEvent):
+    generator = LoadGenerator(arguments, processIndex)
+    startBarrier, endBarrier, decisionBarrier = barriers
+    connectErrors = 0
+
+    for sessionCount in sessionCounts:
+        generator.stats = StepStats()
+        await generator.openSessions(sessionCount)
+        connectErrors += generator.stats.connectErrors
+        await asyncio.to_thread(startBarrier.wait, barrierTimeout)
+
+        # Подключение новых сессий не входит в измеряемое окно шага.
+        generator.stats = StepStats()
+        generator.stats.connectErrors = connectErrors
+        cpuStart = time.process_time()
+        await asyncio.sleep(arguments.stepSeconds)
+
+        stats = generator.stats
+        results.put({
+            "processIndex": processIndex,
+            "alive": generator.aliveCount(),
+            "clientCpuSeconds": time.process_time() - cpuStart,
+            "stats": stats.__dict__
+        })
+        await asyncio.to_thread(endBarrier.wait, barrierTimeout)
+        await asyncio.to_thread(decisionBarrier.wait, barrierTimeout)
+        if stopEvent.is_set():
+            break
+
+    await generator.closeSessions()
+
+def runGeneratorProcess(arguments, processIndex, sessionCounts, barriers, results, stopEvent):
+    # Без нового зерна процессы, унаследовавшие состояние random при fork, гнали бы одинаковую нагрузку.
+    random.seed(None if arguments.seed is None else arguments.seed * 1000 + processIndex)
+    asyncio.run(runGenerator(arguments, processIndex, sessionCounts, barriers, results, stopEvent))
+
+def processTree(rootPid):
+    # Для сервера с воркерами нагрузка и память считаются по всему дереву процессов.
+    children = {}
+    for entry in os.listdir("/proc"):
+        if entry.isdigit():
+            try:
+                with open(f"/proc/{entry}/stat") as file:
+                    parentPid = int(file.read().rsplit(")", 1)[1].split()[1])
+            except (OSError, IndexError, ValueError):
+                continue
+            children.setdefault(parentPid, []).append(int(entry))
+
+    pids = [rootPid]
+    for pid in pids:
+        pids.extend(children.get(pid, []))
+    return pids
+
+def cpuSeconds(pids):
+    total = 0
+    for pid in pids:
+        try:
+            with open(f"/proc/{pid}/stat") as file:
+                fields = file.read().rsplit(")", 1)[1].split()
+            total += int(fields[11]) + int(fields[12])
+        except (OSError, IndexError, ValueError):
+            continue
+    return total / os.sysconf("SC_CLK_TCK")
+
+def rssBytes(pids):
+    total = 0
+    for pid in pids:
+        try:
+            with open(f"/proc/{pid}/status") as file:
+                for line in file:
+                    if line.startswith("VmRSS:"):
+                        total += int(line.split()[1]) * 1024
+        except OSError:
+            continue
+    return total
+
+class ServerMonitor:
+    def __init__(self, serverPid):
+        self.serverPid = serverPid
+        self.available = serverPid is not None and os.path.isdir(f"/proc/{serverPid}")
+
+    def start(self):
+        self.peakRss = 0
+        self.stopEvent = threading.Event()
+        self.cpuStart = cpuSeconds(processTree(self.serverPid)) if self.available else None
+        self.wallStart = time.perf_counter()
+        if self.available:
+            self.thread = threading.Thread(target=self.sampleMemory, daemon=True)
+            self.thread.start()
+
+    def sampleMemory(self):
+        while not self.stopEvent.wait(0.5):
+            self.peakRss = max(self.peakRss, rssBytes(processTree(self.serverPid)))
+
+    def stop(self):
+        if not self.available:
+            return {"serverCpuPercent": None, "serverRssMegabytes": None, "serverProcesses": None}
+
+        self.stopEvent.set()
+        self.thread.join()
+        pids = processTree(self.serverPid)
+        self.peakRss = max(self.peakRss, rssBytes(pids))
+        wallSeconds = time.perf_counter() - self.wallStart
+        return {
+            "serverCpuPercent": round((cpuSeconds(pids) - self.cpuStart) / wallSeconds * 100, 1),
+            "serverRssMegabytes": round(self.peakRss / 2 ** 20, 1),
+            "serverProcesses": len(pids)
+        }
+
+def percentiles(samples):
+    if not samples:
+        return None
+    samples = sorted(samples)
+    pick = lambda fraction: samples[min(int(fraction * len(samples)), len(samples) - 1)] * 1000
+    return {"p50": round(pick(0.5), 3), "p90": round(pick(0.9), 3), "p99": round(pick(0.99), 3),
+            "max": round(samples[-1] * 1000, 3), "samples": len(samples)}
+
+def mergeStep(connections, processResults, seconds):
+    requests = {action: 0 for action in actions}
+    requestLatencies = {action: [] for action in actions}
+    deliveryLatencies = []
+    totals = {"messagesSent": 0, "deliveries": 0, "errors": 0, "timeouts": 0, "connectErrors": 0}
+
+    for processResult in processResults:
+        stats = processResult["stats"]
+        for action in actions:
+            requests[action] += stats["requests"][action]
+            requestLatencies[action].extend(stats["requestLatencies"][action])
+        deliveryLatencies.extend(stats["deliveryLatencies"])
+        for key in totals:
+            totals[key] += stats[key]
+
+    requestCount = sum(requests.values())
+    return {
+        "connections": connections,
+        "alive": sum(processResult["alive"] for processResult in processResults),
+        "connectErrors": totals["connectErrors"],
+        "seconds": seconds,
+        "requests": requests,
+        "requestsPerSecond": round(requestCount / seconds, 1),
+        "messagesSent": totals["messagesSent"],
+        "messagesPerSecond": round(totals["messagesSent"] / seconds, 1),
+        "deliveries": totals["deliveries"],
+        "deliveriesPerSecond": round(totals["deliveries"] / seconds, 1),
+        "errors": totals["errors"],
+        "timeouts": totals["timeouts"],
+        "errorRate": round((totals["errors"] + totals["timeouts"]) / max(requestCount, 1), 5),
+        "requestLatencyMs": {action: percentiles(samples) for action, samples in requestLatencies.items()},
+        "deliveryLatencyMs": percentiles(deliveryLatencies),
+        "clientCpuPercent": round(sum(processResult["clientCpuSeconds"] for processResult in processResults)
+                                  / seconds * 100, 1)
+    }
+
+def failureReason(step, arguments):
+    # Шаг считается провалом, если сервер теряет соединения, отвечает ошибками или задержка уходит за порог.
+    if step["alive"] < step["connections"] * (1 - arguments.maxErrorRate):
+        return f"только {step['alive']} из {step['connections']} соединений живы"
+    if step["errorRate"] > arguments.maxErrorRate:
+        return f"доля ошибок {step['errorRate']}"
+    for action, latency in step["requestLatencyMs"].items():
+        if latency and latency["p99"] > arguments.maxLatency * 1000:
+            return f"p99 задержки {action} {latency['p99']} мс"
+    if step["deliveryLatencyMs"] and step["deliveryLatencyMs"]["p99"] > arguments.maxLatency * 1000:
+        return f"p99 доставки {step['deliveryLatencyMs']['p99']} мс"
+    return None
+
+def startServer(arguments, workDirectory):
+    command = [sys.executable, os.path.join(os.path.dirname(os.path.abspath(__file__)), serverScripts[arguments.server]),
+               "--host", arguments.host, "--port", str(arguments.port)]
+    if arguments.server == "asyncio":
+        command += ["--workers", str(arguments.workers), "--history", os.path.join(workDirectory, "chatHistory.db"),
+                    "--brokerPath", os.path.join(workDirectory, "broker.sock")]
+    serverProcess = subprocess.Popen(command, cwd=workDirectory, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+
+    deadline = time.monotonic() + 10
+    while time.monotonic() < deadline:
+        if serverProcess.poll() is not None:
+            raise RuntimeError(f"Сервер завершился с кодом {serverProcess.returncode}")
+        try:
+            socket.create_connection((arguments.host, arguments.port), timeout=0.5).close()
+            return serverProcess
+        except OSError:
+            time.sleep(0.1)
+    serverProcess.kill()
+    raise RuntimeError("Сервер не начал принимать соединения")
+
+def stopServer(serverProcess):
+    serverProcess.send_signal(signal.SIGINT)
+    try:
+        serverProcess.wait(10)
+    except subprocess.TimeoutExpired:
+        serverProcess.kill()
+        serverProcess.wait()
+
+def prepareRooms(arguments):
+    # Общие комнаты создаются до нагрузки одним соединением, так что сессии сразу могут в них писать.
+    async def createRooms():
+        reader, writer = await asyncio.open_connection(arguments.host, arguments.port)
+        for roomIndex in range(arguments.rooms):
+            await writeFrame(writer, {"action": "create_room", "room": f"room{roomIndex}"})
+            await readFrame(reader)
+        writer.close()
+
+    asyncio.run(createRooms())
+
+def parseMix(text):
+    mix = {action: 0.0 for action in actions}
+    for item in text.split(","):
+        action, weight = item.split("=")
+        if action not in mix:
+            raise argparse.ArgumentTypeError(f"неизвестное действие {action}")
+        mix[action] = float(weight)
+    return mix
+
+def raiseFileLimit():
+    # Тысячи соединений не помещаются в стандартный лимит в 1024 дескриптора; сервер наследует поднятый лимит.
+    softLimit, hardLimit = resource.getrlimit(resource.RLIMIT_NOFILE)
+    if hardLimit == resource.RLIM_INFINITY or hardLimit > softLimit:
+        resource.setrlimit(resource.RLIMIT_NOFILE, (hardLimit, hardLimit))
+    return resource.getrlimit(resource.RLIMIT_NOFILE)[0]
+
+def runLoadTest(arguments):
+    fileLimit = raiseFileLimit()
+    with tempfile.TemporaryDirectory() as workDirectory:
+        serverProcess = None if arguments.attach else startServer(arguments, workDirectory)
+        serverPid = serverProcess.pid if serverProcess else arguments.serverPid
+        try:
+            prepareRooms(arguments)
+
+            # Сессии каждого шага делятся между процессами генератора, чтобы сам генератор не упёрся в одно ядро.
+            shares = [[connections // arguments.processes + (processIndex < connections % arguments.processes)
+                       for connections in arguments.connections] for processIndex in range(arguments.processes)]
+            barriers = [multiprocessing.Barrier(arguments.processes + 1) for _ in range(3)]
+            results = multiprocessing.Queue()
+            stopEvent = multiprocessing.Event()
+            generators = [multiprocessing.Process(target=runGeneratorProcess,
+                                                  args=(arguments, processIndex, shares[processIndex], barriers,
+                                                        results, stopEvent))
+                          for processIndex in range(arguments.processes)]
+            for generator in generators:
+                generator.start()
+
+            monitor = ServerMonitor(serverPid)
+            steps = []
+            breakingPoint = None
+            for connections in arguments.connections:
+                barriers[0].wait(barrierTimeout)
+                monitor.start()
+                stepStart = time.perf_counter()
+                barriers[1].wait(barrierTimeout)
+                seconds = time.perf_counter() - stepStart
+                serverUsage = monitor.stop()
+
+                step = mergeStep(connections, [results.get() for _ in generators], seconds)
+                step.update(serverUsage)
+                steps.append(step)
+                print(json.dumps({key: step[key] for key in ("connections", "alive", "requestsPerSecond",
+                                                             "deliveriesPerSecond", "errorRate", "serverCpuPercent",
+                                                             "serverRssMegabytes")}), file=sys.stderr)
+
+                reason = failureReason(step, arguments)
+                if reason is not None:
+                    breakingPoint = {"connections": connections, "reason": reason}
+                    stopEvent.set()
+                barriers[2].wait(barrierTimeout)
+                if breakingPoint is not None:
+                    break
+
+            for generator in generators:
+                generator.join()
+        finally:
+            if serverProcess is not None:
+                stopServer(serverProcess)
+
+    return {
+        "python": sys.version.split()[0],
+        "cpuCount": os.cpu_count(),
+        "fileLimit": fileLimit,
+        "server": {"kind": arguments.server, "delivery": deliveryModes[arguments.server],
+                   "workers": arguments.workers if arguments.server == "asyncio" else None,
+                   "attached": arguments.attach},
+        "load": {"rooms": arguments.rooms, "ratePerSession": arguments.rate, "mix": arguments.mix,
+                 "messageSize": arguments.messageSize, "pollInterval": arguments.pollInterval,
+                 "stepSeconds": arguments.stepSeconds, "generatorProcesses": arguments.processes},
+        "steps": steps,
+        "breakingPoint": breakingPoint
+    }
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Нагрузочный тест чат-серверов: ступенчато наращивает число сессий "
+                                                 "и пишет JSON-отчёт.")
+    parser.add_argument("--server", choices=sorted(serverScripts), default="asyncio")
+    parser.add_argument("--workers", type=int, default=1, help="воркеры server.py")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=5700)
+    parser.add_argument("--attach", action="store_true", help="не запускать сервер, а подключиться к работающему")
+    parser.add_argument("--serverPid", type=int, default=None, help="pid работающего сервера для замера CPU и памяти")
+    parser.add_argument("--connections", type=int, nargs="+", default=[100, 500, 1000, 2000, 4000],
+                        help="число сессий на каждом шаге")
+    parser.add_argument("--stepSeconds", type=float, default=10.0)
+    parser.add_argument("--rooms", type=int, default=20)
+    parser.add_argument("--rate", type=float, default=0.5, help="действий в секунду на сессию")
+    parser.add_argument("--mix", type=parseMix, default="send_message=0.5,get_messages=0.25,get_rooms=0.2,create_room=0.05")
+    parser.add_argument("--messageSize", type=int, default=64)
+    parser.add_argument("--pollInterval", type=float, default=1.0, help="опрос get_messages для serverSocket.py")
+    parser.add_argument("--processes", type=int, default=max(1, min(4, (os.cpu_count() or 2) // 2)),
+                        help="процессы генератора")
+    parser.add_argument("--connectConcurrency", type=int, default=200)
+    parser.add_argument("--timeout", type=float, default=10.0, help="тайм-аут подключения и запроса")
+    parser.add_argument("--maxLatency", type=float, default=2.0, help="порог p99 задержки в секундах")
+    parser.add_argument("--maxErrorRate", type=float, default=0.01)
+    parser.add_argument("--seed", type=int, default=None)
+    parser.add_argument("--output", default=None)
+    arguments = parser.parse_args()
+
+    report = runLoadTest(arguments)
+    if arguments.output:
+        with open(arguments.output, "w", encoding="utf-8") as file:
+            json.dump(report, file, indent=4, ensure_ascii=False)
+    else:
+        print(json.dumps(report, indent=4, ensure_ascii=False))
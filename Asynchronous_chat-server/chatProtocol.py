@@ -0,0 +1,122 @@
+import json
+import struct
+from collections import deque
+
+try:
+    import msgpack
+except ImportError:
+    msgpack = None
+
+# Кадр: 4 байта длины полезной нагрузки, 1 байт кодека, затем сама нагрузка.
+frameHeader = struct.Struct(">IB")
+jsonCodec = 0
+msgpackCodec = 1
+maxFrameSize = 16 * 1024 * 1024
+
+class ProtocolError(Exception):
+    pass
+
+def encodeFrame(message):
+    if msgpack is not None:
+        codec, payload = msgpackCodec, msgpack.packb(message, use_bin_type=True)
+    else:
+        codec, payload = jsonCodec, json.dumps(message, ensure_ascii=False, separators=(",", ":")).encode("utf-8")
+
+    if len(payload) > maxFrameSize:
+        raise ProtocolError(f"Слишком большой кадр: {len(payload)} байт.")
+    return frameHeader.pack(len(payload), codec) + payload
+
+def checkStrings(value):
+    # json.loads пропускает одиночные суррогаты из экранирования \ud800, а такую строку нельзя снова закодировать
+    # в UTF-8: попав в историю, она ломала бы кадры всем, кто читает комнату.
+    if isinstance(value, str):
+        value.encode("utf-8")
+    elif isinstance(value, dict):
+        for key, item in value.items():
+            checkStrings(key)
+            checkStrings(item)
+    elif isinstance(value, list):
+        for item in value:
+            checkStrings(item)
+
+def decodePayload(codec, payload):
+    # Ошибки разбора (у msgpack и json это наследники ValueError) становятся ошибкой протокола, как и неизвестный кодек.
+    if codec == msgpackCodec:
+        if msgpack is None:
+            raise ProtocolError("Получен кадр msgpack, но модуль msgpack не установлен.")
+        try:
+            return msgpack.unpackb(payload, raw=False)
+        except ValueError as e:
+            raise ProtocolError(f"Некорректный кадр msgpack: {e}") from e
+    if codec == jsonCodec:
+        try:
+            message = json.loads(payload.decode("utf-8"))
+            # Суррогат может прийти только через экранирование, поэтому обычные кадры не обходятся.
+            if b"\\u" in payload:
+                checkStrings(message)
+        except ValueError as e:
+            raise ProtocolError(f"Некорректный кадр JSON: {e}") from e
+        return message
+    raise ProtocolError(f"Неизвестный кодек кадра: {codec}.")
+
+def parseHeader(header):
+    length, codec = frameHeader.unpack(header)
+    if length > maxFrameSize:
+        raise ProtocolError(f"Слишком большой кадр: {length} байт.")
+    return length, codec
+
+class FrameDecoder:
+    # Разбирает поток байтов на кадры: одно чтение может содержать несколько запросов
+    # или только часть одного, остаток ждёт следующего вызова feed.
+    def __init__(self):
+        self.buffer = bytearray()
+
+    def feed(self, data):
+        self.buffer += data
+        messages = []
+        offset = 0
+
+        while len(self.buffer) - offset >= frameHeader.size:
+            length, codec = parseHeader(self.buffer[offset:offset + frameHeader.size])
+            frameEnd = offset + frameHeader.size + length
+            if len(self.buffer) < frameEnd:
+                break
+            messages.append(decodePayload(codec, bytes(self.buffer[offset + frameHeader.size:frameEnd])))
+            offset = frameEnd
+
+        del self.buffer[:offset]
+        return messages
+
+async def readFrame(reader):
+    header = await reader.readexactly(frameHeader.size)
+    length, codec = parseHeader(header)
+    return decodePayload(codec, await reader.readexactly(length))
+
+async def writeFrame(writer, message):
+    writer.write(encodeFrame(message))
+    await writer.drain()
+
+class FrameConnection:
+    # Обёртка над блокирующим сокетом для клиентов на потоках.
+    def __init__(self, sock):
+        self.socket = sock
+        self.decoder = FrameDecoder()
+        self.pending = deque()
+
+    def send(self, message):
+        self.socket.sendall(encodeFrame(message))
+
+    def receive(self):
+        while not self.pending:
+            data = self.socket.recv(65536)
+            if not data:
+                raise ConnectionError("Соединение закрыто сервером.")
+            self.pending.extend(self.decoder.feed(data))
+        return self.pending.popleft()
+
+    def request(self, message):
+        self.send(message)
+        return self.receive()
+
+    def close(self):
+        self.socket.close()
@@ -1,7 +1,10 @@
+import queue
 import socket
+import threading
 import tkinter as tk
-from tkinter import simpledialog
-import pickle
+from tkinter import messagebox, simpledialog
+
+from chatProtocol import FrameConnection
 
 
 class ChatClient:
@@ -11,6 +14,13 @@ class ChatClient:
         
         self.socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
         self.socket.connect(("localhost", 5555))
+        self.connection = FrameConnection(self.socket)
+
+        # Поток чтения раскладывает ответы и события подписок по разным очередям, Tk читает их в главном потоке.
+        self.responses = queue.Queue()
+        self.events = queue.Queue()
+        self.disconnected = threading.Event()
+        threading.Thread(target=self.receiveFrames, daemon=True).start()
         
         self.username = simpledialog.askstring("Имя пользователя", "Введите ваше имя:")
         
@@ -49,64 +59,131 @@ class ChatClient:
         self.roomLabel.pack(side=tk.LEFT, padx=10)
 
         self.currentRoom = None
-        self.updateRoomList()
+        self.lastSeq = 0
+        self.showRooms(self.request({"action": "subscribe"}).get("rooms", []))
+        self.master.after(50, self.processEvents)
+
+    def request(self, request):
+        # После обрыва ответов больше не будет, поэтому запрос сразу возвращает disconnected, а не ждёт очередь вечно.
+        if self.disconnected.is_set():
+            return {"status": "disconnected"}
+        try:
+            self.connection.send(request)
+        except OSError:
+            self.disconnected.set()
+            return {"status": "disconnected"}
+        return self.responses.get()
+
+    def receiveFrames(self):
+        try:
+            while True:
+                frame = self.connection.receive()
+                if "event" in frame:
+                    self.events.put(frame)
+                else:
+                    self.responses.put(frame)
+        except (ConnectionError, OSError):
+            self.disconnected.set()
+            # Будит запрос, который уже ждёт ответа; следующие увидят флаг.
+            self.responses.put({"status": "disconnected"})
+
+    def processEvents(self):
+        while True:
+            try:
+                event = self.events.get_nowait()
+            except queue.Empty:
+                break
+
+            kind = event["event"]
+            if kind == "message" and event["room"] == self.currentRoom:
+                self.appendMessages([(event["seq"], event["user"], event["message"])])
+                if self.lastSeq < event["seq"]:
+                    self.updateMessages()
+            elif kind == "room_created":
+                self.roomList.insert(tk.END, event["room"])
+            elif kind == "resync":
+                if event["roomList"]:
+                    self.updateRoomList()
+                if self.currentRoom in event["rooms"]:
+                    self.updateMessages()
+
+        if self.disconnected.is_set():
+            self.showDisconnected()
+            return
+        self.master.after(50, self.processEvents)
+
+    def showDisconnected(self):
+        self.roomLabel.config(text="Соединение с сервером потеряно")
+        for widget in (self.createRoomButton, self.joinRoomButton, self.inputMessage):
+            widget.config(state=tk.DISABLED)
+        messagebox.showerror("Ошибка", "Соединение с сервером потеряно.")
     
     def updateRoomList(self):
         request = {"action": "get_rooms"}
-        self.socket.send(pickle.dumps(request))
-        
-        response = pickle.loads(self.socket.recv(1024))
-        rooms = response.get("rooms", [])
-        
+        response = self.request(request)
+        self.showRooms(response.get("rooms", []))
+
+    def showRooms(self, rooms):
         self.roomList.delete(0, tk.END)
         for room in rooms:
             self.roomList.insert(tk.END, room)
-
-        self.master.after(2000, self.updateRoomList)
     
     def createRoom(self):
         roomName = simpledialog.askstring("Новая комната", "Введите название комнаты:")
         if roomName:
             request = {"action": "create_room", "room": roomName}
-            self.socket.send(pickle.dumps(request))
-            response = pickle.loads(self.socket.recv(1024))
-            if response.get("status") == "room_created":
-                self.updateRoomList()
+            self.request(request)
 
     def joinRoom(self):
         selectedRoom = self.roomList.get(tk.ACTIVE)
         if selectedRoom:
+            if self.currentRoom:
+                self.request({"action": "unsubscribe", "room": self.currentRoom})
             self.currentRoom = selectedRoom
             self.roomLabel.config(text=f"Текущая комната: {self.currentRoom}")
-            self.messageBox.config(state=tk.NORMAL)
-            self.messageBox.delete(1.0, tk.END)
-            self.messageBox.config(state=tk.DISABLED)
-            self.updateMessages()
+
+            # Последние сообщения приходят в ответе на подписку, дальше новые сообщения присылает сам сервер.
+            response = self.request({"action": "subscribe", "room": selectedRoom})
+            messages = response.get("messages", [])
+            self.lastSeq = messages[0][0] - 1 if messages else response.get("lastSeq", 0)
+            self.showMessages(messages)
     
     def updateMessages(self):
-        if self.currentRoom:
-            request = {"action": "get_messages", "room": self.currentRoom}
-            self.socket.send(pickle.dumps(request))
-            response = pickle.loads(self.socket.recv(1024))
+        # Дочитываются только сообщения после последнего показанного, страницами, пока не догоним сервер.
+        while self.currentRoom:
+            request = {"action": "get_messages", "room": self.currentRoom, "since": self.lastSeq}
+            response = self.request(request)
             messages = response.get("messages", [])
-            
-            self.messageBox.config(state=tk.NORMAL)
-            self.messageBox.delete(1.0, tk.END)
-            for user, msg in messages:
-                self.messageBox.insert(tk.END, f"{user}: {msg}\n")
-            self.messageBox.config(state=tk.DISABLED)
-
-        self.master.after(1000, self.updateMessages)
+            self.appendMessages(messages)
+            if not messages or self.lastSeq >= response.get("lastSeq", 0):
+                break
+
+    def showMessages(self, messages):
+        self.messageBox.config(state=tk.NORMAL)
+        self.messageBox.delete(1.0, tk.END)
+        self.messageBox.config(state=tk.DISABLED)
+        self.appendMessages(messages)
+
+    def appendMessages(self, messages):
+        # Номера сообщений в комнате идут подряд: повторы пропускаются, на разрыве показ останавливается.
+        self.messageBox.config(state=tk.NORMAL)
+        for seq, user, msg in messages:
+            if seq <= self.lastSeq:
+                continue
+            if seq > self.lastSeq + 1:
+                break
+            self.messageBox.insert(tk.END, f"{user}: {msg}\n")
+            self.lastSeq = seq
+        self.messageBox.config(state=tk.DISABLED)
+        self.messageBox.see(tk.END)
 
     def sendMessage(self, event=None):
         message = self.inputMessage.get()
         if self.currentRoom and message:
             request = {"action": "send_message", "room": self.currentRoom, "user": self.username, "message": message}
-            self.socket.send(pickle.dumps(request))
-            response = pickle.loads(self.socket.recv(1024))
+            response = self.request(request)
             if response.get("status") == "message_sent":
                 self.inputMessage.delete(0, tk.END)
-                self.updateMessages()
 
 
 if __name__ == "__main__":
@@ -0,0 +1,216 @@
+import asyncio
+import sqlite3
+from collections import OrderedDict, deque
+from itertools import islice
+
+class RoomHistory:
+    def __init__(self, lastSeq, recentMessages, recentLimit):
+        self.lastSeq = lastSeq
+        self.recent = deque(recentMessages, maxlen=recentLimit)
+
+    def firstRecentSeq(self):
+        return self.recent[0][0] if self.recent else self.lastSeq + 1
+
+class HistoryStore:
+    # В памяти у каждой комнаты только кольцевой буфер последних сообщений, вся история лежит
+    # в журнале SQLite, куда сообщения только дописываются пачками. Номер сообщения в комнате
+    # растёт без пропусков, поэтому клиент может дочитать ровно то, что пропустил.
+    def __init__(self, path, recentLimit=1000, flushBatchSize=256, maxLoadedRooms=1024):
+        self.recentLimit = recentLimit
+        self.flushBatchSize = flushBatchSize
+        self.maxLoadedRooms = maxLoadedRooms
+        self.pendingMessages = []
+        # Буферы комнат в порядке последнего обращения: комнат может быть сколько угодно, а в памяти держатся
+        # только maxLoadedRooms недавних, остальные при следующем обращении снова поднимаются с диска.
+        self.roomHistories = OrderedDict()
+
+        self.database = sqlite3.connect(path)
+        self.database.execute("PRAGMA journal_mode=WAL")
+        self.database.execute("PRAGMA synchronous=NORMAL")
+        self.database.execute("CREATE TABLE IF NOT EXISTS rooms (name TEXT PRIMARY KEY)")
+        self.database.execute("CREATE TABLE IF NOT EXISTS messages (room TEXT, seq INTEGER, user TEXT, message TEXT, "
+                              "PRIMARY KEY (room, seq)) WITHOUT ROWID")
+        self.database.commit()
+
+        self.roomNames = [name for name, in self.database.execute("SELECT name FROM rooms ORDER BY rowid")]
+        self.roomNameSet = set(self.roomNames)
+
+    def rooms(self):
+        return list(self.roomNames)
+
+    def hasRoom(self, room):
+        return room in self.roomNameSet
+
+    def createRoom(self, room):
+        if room in self.roomNameSet:
+            return False
+
+        self.database.execute("INSERT INTO rooms (name) VALUES (?)", (room,))
+        self.database.commit()
+        self.roomNames.append(room)
+        self.roomNameSet.add(room)
+        return True
+
+    def roomHistory(self, room):
+        # Буфер комнаты поднимается с диска при первом обращении после запуска или после выгрузки.
+        history = self.roomHistories.get(room)
+        if history is not None:
+            self.roomHistories.move_to_end(room)
+            return history
+
+        if len(self.roomHistories) >= self.maxLoadedRooms:
+            # Номер следующего сообщения выгруженной комнаты потом возьмётся из журнала,
+            # поэтому её ещё не записанные сообщения сначала сбрасываются.
+            oldestRoom = next(iter(self.roomHistories))
+            if any(pendingRoom == oldestRoom for pendingRoom, *_ in self.pendingMessages):
+                self.flush()
+            del self.roomHistories[oldestRoom]
+
+        rows = self.database.execute("SELECT seq, user, message FROM messages WHERE room = ? "
+                                     "ORDER BY seq DESC LIMIT ?", (room, self.recentLimit)).fetchall()
+        rows.reverse()
+        history = RoomHistory(rows[-1][0] if rows else 0, rows, self.recentLimit)
+        self.roomHistories[room] = history
+        return history
+
+    def lastSeq(self, room):
+        return self.roomHistory(room).lastSeq
+
+    def append(self, room, user, message):
+        # Из буфера сообщение читают сразу, а в журнал оно попадает только при сбросе, поэтому строку,
+        # которую SQLite не примет, нужно отсечь до буфера, а не терять потом при записи.
+        if not (isText(user) and isText(message)):
+            raise ValueError(f"Сообщение комнаты {room!r} не записать в историю: поля должны быть строками UTF-8.")
+
+        history = self.roomHistory(room)
+        history.lastSeq += 1
+        history.recent.append((history.lastSeq, user, message))
+
+        self.pendingMessages.append((room, history.lastSeq, user, message))
+        if len(self.pendingMessages) >= self.flushBatchSize:
+            self.flush()
+        return history.lastSeq
+
+    def messagesSince(self, room, since, limit):
+        history = self.roomHistory(room)
+        since = max(since, 0)
+        if since >= history.lastSeq:
+            return []
+
+        firstRecentSeq = history.firstRecentSeq()
+        if since + 1 >= firstRecentSeq:
+            start = since + 1 - firstRecentSeq
+            return list(islice(history.recent, start, start + limit))
+
+        # Клиент отстал дальше кольцевого буфера, остаток дочитывается из журнала по индексу (room, seq).
+        self.flush()
+        return self.database.execute("SELECT seq, user, message FROM messages WHERE room = ? AND seq > ? "
+                                     "ORDER BY seq LIMIT ?", (room, since, limit)).fetchall()
+
+    def latestMessages(self, room, limit):
+        history = self.roomHistory(room)
+        return self.messagesSince(room, history.lastSeq - limit, limit)
+
+    def flush(self):
+        if not self.pendingMessages:
+            return
+
+        insertMessage = "INSERT INTO messages (room, seq, user, message) VALUES (?, ?, ?, ?)"
+        try:
+            with self.database:
+                self.database.executemany(insertMessage, self.pendingMessages)
+        except sqlite3.Error:
+            # Одна негодная строка не должна застрять в пачке и ронять все следующие сбросы:
+            # пачка пишется заново построчно, а строки, которые не записываются, выбрасываются.
+            # Содержимое строк проверено ещё в append, так что сюда приводят только сбои самой базы.
+            with self.database:
+                for row in self.pendingMessages:
+                    try:
+                        self.database.execute(insertMessage, row)
+                    except sqlite3.Error as e:
+                        print(f"Сообщение {row[1]} комнаты {row[0]!r} не записано в историю: {e}")
+        self.pendingMessages.clear()
+
+    def close(self):
+        self.flush()
+        self.database.close()
+
+async def flushPeriodically(history, interval):
+    while True:
+        await asyncio.sleep(interval)
+        try:
+            history.flush()
+        except sqlite3.Error as e:
+            # Сообщения остаются в очереди и уйдут следующим сбросом, задача при этом не завершается.
+            print(f"Ошибка записи истории: {e}")
+
+def isText(value):
+    # Одиночный суррогат из JSON-экранирования \ud800 — тоже str, но ни в SQLite, ни в кадр ответа его не записать.
+    if not isinstance(value, str):
+        return False
+    try:
+        value.encode("utf-8")
+    except UnicodeEncodeError:
+        return False
+    return True
+
+def isOptionalInteger(value):
+    # bool в Python — тоже int, но номером сообщения или размером страницы быть не может.
+    return value is None or (isinstance(value, int) and not isinstance(value, bool))
+
+class HistoryService:
+    # Действия клиентов над комнатами и историей. Одиночный сервер вызывает их у себя, а в режиме
+    # нескольких процессов — только брокер, так что номера сообщений раздаёт кто-то один.
+    # emit получает события о новых комнатах и сообщениях для рассылки подписчикам.
+    def __init__(self, history, emit, defaultPageSize=100, maxPageSize=1000):
+        self.history = history
+        self.emit = emit
+        self.defaultPageSize = defaultPageSize
+        self.maxPageSize = maxPageSize
+
+    def messagePage(self, room, since, limit):
+        # Без since отдаются последние сообщения, с since — следующие за ним; сообщения идут как (seq, user, message).
+        limit = min(max(limit or self.defaultPageSize, 1), self.maxPageSize)
+        if since is None:
+            messages = self.history.latestMessages(room, limit)
+        else:
+            messages = self.history.messagesSince(room, since, limit)
+        return messages, self.history.lastSeq(room)
+
+    def execute(self, request):
+        action = request.get("action")
+        room = request.get("room")
+        user = request.get("user")
+        message = request.get("message")
+
+        # Поля приходят из msgpack или JSON и могут оказаться чем угодно; в журнал и рассылку попадают только строки.
+        if action in ("create_room", "send_message", "get_messages") and not isText(room):
+            return {"status": "invalid_request"}
+        if action == "send_message" and not (isText(user) and isText(message)):
+            return {"status": "invalid_request"}
+
+        if action == "create_room":
+            if self.history.createRoom(room):
+                self.emit({"event": "room_created", "room": room})
+            return {"status": "room_created"}
+
+        elif action == "get_rooms":
+            return {"rooms": self.history.rooms()}
+
+        elif action == "send_message":
+            if self.history.hasRoom(room):
+                seq = self.history.append(room, user, message)
+                self.emit({"event": "message", "room": room, "seq": seq, "user": user, "message": message})
+                return {"status": "message_sent", "seq": seq}
+            return {"status": "room_not_found"}
+
+        elif action == "get_messages":
+            since, limit = request.get("since"), request.get("limit")
+            if not (isOptionalInteger(since) and isOptionalInteger(limit)):
+                return {"status": "invalid_request"}
+            if not self.history.hasRoom(room):
+                return {"status": "room_not_found", "messages": [], "lastSeq": 0}
+            messages, lastSeq = self.messagePage(room, since, limit)
+            return {"messages": messages, "lastSeq": lastSeq}
+
+        return {"status": "unknown_action"}
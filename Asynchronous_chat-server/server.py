@@ -1,71 +1,275 @@
+import argparse
 import asyncio
-import pickle
+import multiprocessing
+import multiprocessing.connection
+import os
+import signal
+import socket
+import tempfile
+import time
 
-rooms = {}
+from chatBroker import BrokerClient, runBroker
+from chatProtocol import ProtocolError, encodeFrame, readFrame
+from historyStore import HistoryService, HistoryStore, flushPeriodically
+
+clientQueueSize = 256
+historyFlushInterval = 1.0
+workerRestartDelay = 1.0
+
+store = None
+roomSubscribers = {}
+roomListSubscribers = set()
+
+class ClientSession:
+    # Всё, что уходит клиенту, проходит через ограниченную очередь и отдельную задачу записи,
+    # поэтому медленный клиент не задерживает рассылку остальным и не копит память без предела.
+    def __init__(self, writer):
+        self.writer = writer
+        self.outbox = asyncio.Queue(clientQueueSize)
+        self.rooms = set()
+        self.missedRooms = set()
+        self.missedRoomList = False
+
+    async def reply(self, response):
+        await self.outbox.put(encodeFrame(response))
+
+    def push(self, frame, room=None):
+        if not self.outbox.full():
+            self.outbox.put_nowait(frame)
+        elif room is None:
+            self.missedRoomList = True
+        else:
+            self.missedRooms.add(room)
+
+    def pushResync(self):
+        # Вместо потерянных событий клиент получает одно уведомление и сам перечитывает комнату или список комнат.
+        if (self.missedRooms or self.missedRoomList) and not self.outbox.full():
+            self.outbox.put_nowait(encodeFrame({"event": "resync", "rooms": sorted(self.missedRooms),
+                                                "roomList": self.missedRoomList}))
+            self.missedRooms.clear()
+            self.missedRoomList = False
+
+    async def writeOutbox(self):
+        try:
+            while True:
+                self.writer.write(await self.outbox.get())
+                self.pushResync()
+                # drain ждёт только когда буфер транспорта выше порога, иначе медленный клиент
+                # копил бы отставание там, а не в ограниченной очереди.
+                await self.writer.drain()
+        except ConnectionError:
+            # Закрытие транспорта завершит и чтение в handleClient.
+            self.writer.close()
+
+    def unsubscribeAll(self):
+        for room in self.rooms:
+            roomSubscribers[room].discard(self)
+        self.rooms.clear()
+        roomListSubscribers.discard(self)
+
+def publish(subscribers, event, room=None):
+    # Кадр кодируется один раз на всех подписчиков.
+    if not subscribers:
+        return
+    frame = encodeFrame(event)
+    for session in subscribers:
+        session.push(frame, room)
+
+def deliverEvent(event):
+    if event["event"] == "room_created":
+        publish(roomListSubscribers, event)
+    else:
+        publish(roomSubscribers.get(event["room"], ()), event, event["room"])
+
+class LocalStore:
+    # История в этом же процессе; в режиме нескольких воркеров её место занимает BrokerClient с тем же request.
+    def __init__(self, history):
+        self.service = HistoryService(history, deliverEvent)
+
+    async def request(self, request, onResponse=None):
+        response = self.service.execute(request)
+        if onResponse is not None:
+            onResponse(response)
+        return response
+
+async def handleRequest(request, session):
+    action = request.get("action")
+    room = request.get("room")
+
+    # subscribe без комнаты подписывает на появление новых комнат, с комнатой — на её новые сообщения.
+    # Подписчик добавляется в момент получения страницы истории, поэтому между ней и первым событием
+    # ничего не теряется и не повторяется; переподключившийся клиент передаёт since и получает только пропущенное.
+    if action == "subscribe":
+        if room is None:
+            response = await store.request({"action": "get_rooms"}, lambda response: roomListSubscribers.add(session))
+            return {"status": "subscribed", "rooms": response["rooms"]}
+
+        # Страница истории приходит без status, а status в ответе означает отказ: комнаты нет или запрос неверен.
+        def addSubscriber(response):
+            if "status" not in response:
+                roomSubscribers.setdefault(room, set()).add(session)
+                session.rooms.add(room)
+
+        response = await store.request({"action": "get_messages", "room": room, "since": request.get("since"),
+                                        "limit": request.get("limit")}, addSubscriber)
+        if "status" in response:
+            return {"status": response["status"]}
+        return {"status": "subscribed", "room": room, "messages": response["messages"], "lastSeq": response["lastSeq"]}
+
+    elif action == "unsubscribe":
+        if room is None:
+            roomListSubscribers.discard(session)
+        elif room in session.rooms:
+            roomSubscribers[room].discard(session)
+            session.rooms.discard(room)
+        return {"status": "unsubscribed"}
+
+    return await store.request(request)
 
 async def handleClient(reader, writer):
     addr = writer.get_extra_info('peername')
     print(f"Клиент подключился: {addr}")
 
+    session = ClientSession(writer)
+    writerTask = asyncio.create_task(session.writeOutbox())
+
     try:
         while True:
-            data = await reader.read(1024)
-            if not data:
+            try:
+                request = await readFrame(reader)
+            except asyncio.IncompleteReadError:
                 print(f"Клиент {addr} отключился.")
                 break
 
-            try:
-                request = pickle.loads(data)
-            except Exception as e:
-                print(f"Ошибка при десериализации данных: {e}")
-                continue
-
-            action = request.get("action")
-            room = request.get("room")
-            user = request.get("user")
-            message = request.get("message")
-
-            if action == "create_room":
-                if room not in rooms:
-                    rooms[room] = []
-                response = pickle.dumps({"status": "room_created"})
-                writer.write(response)
-                await writer.drain()
-
-            elif action == "get_rooms":
-                response = pickle.dumps({"rooms": list(rooms.keys())})
-                writer.write(response)
-                await writer.drain()
-
-            elif action == "send_message":
-                if room in rooms:
-                    rooms[room].append((user, message))
-                    response = pickle.dumps({"status": "message_sent"})
-                    writer.write(response)
-                    await writer.drain()
-
-            elif action == "get_messages":
-                if room in rooms:
-                    response = pickle.dumps({"messages": rooms[room]})
-                else:
-                    response = pickle.dumps({"messages": []})
-                writer.write(response)
-                await writer.drain()
+            # Запросы, пришедшие одним пакетом, уже лежат в буфере reader; ответ ждёт только когда
+            # очередь клиента заполнена, то есть сам клиент не успевает читать.
+            await session.reply(await handleRequest(request, session))
+            # Без уступки цикл разобрал бы весь пакет подряд, и очереди подписчиков переполнились бы
+            # раньше, чем их задачи записи успеют что-то отправить.
+            await asyncio.sleep(0)
 
+    except ProtocolError as e:
+        print(f"Ошибка протокола: {e}")
     except Exception as e:
         print(f"Ошибка: {e}")
     finally:
+        session.unsubscribeAll()
+        writerTask.cancel()
         writer.close()
-        await writer.wait_closed()
+        try:
+            await writer.wait_closed()
+        except ConnectionError:
+            pass
         print(f"Соединение с клиентом {addr} закрыто.")
 
-async def main():
-    server = await asyncio.start_server(handleClient, "0.0.0.0", 5555)
-    print("Сервер запущен...")
+def createListeningSocket(host, port, reusePort):
+    # С явным IPPROTO_TCP asyncio отключает алгоритм Нейгла на принятых соединениях; без него событие
+    # и следующий за ним ответ уходили бы с задержкой подтверждения TCP в десятки миллисекунд.
+    listeningSocket = socket.socket(socket.AF_INET, socket.SOCK_STREAM, socket.IPPROTO_TCP)
+    listeningSocket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    if reusePort:
+        # Каждый воркер слушает свой сокет на общем порту, а ядро распределяет между ними новые соединения.
+        listeningSocket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEPORT, 1)
+    listeningSocket.bind((host, port))
+    return listeningSocket
+
+async def serve(host, port, historyPath=None, brokerPath=None):
+    global store
+    if brokerPath is None:
+        history = HistoryStore(historyPath)
+        store = LocalStore(history)
+        flushTask = asyncio.create_task(flushPeriodically(history, historyFlushInterval))
+    else:
+        store = BrokerClient(deliverEvent)
+        await store.connect(brokerPath)
+
+    server = await asyncio.start_server(handleClient, sock=createListeningSocket(host, port, brokerPath is not None),
+                                        backlog=1024)
+    print(f"Сервер запущен (pid {os.getpid()})...")
+
+    try:
+        async with server:
+            if brokerPath is None:
+                await server.serve_forever()
+            else:
+                # Воркер без брокера не может обслуживать клиентов, поэтому завершается вместе с соединением.
+                await store.readerTask
+    finally:
+        if brokerPath is None:
+            flushTask.cancel()
+            history.close()
+
+def runWorker(host, port, brokerPath):
+    signal.signal(signal.SIGTERM, signal.default_int_handler)
+    try:
+        asyncio.run(serve(host, port, brokerPath=brokerPath))
+    except KeyboardInterrupt:
+        pass
+
+def startWorker(host, port, brokerPath):
+    worker = multiprocessing.Process(target=runWorker, args=(host, port, brokerPath))
+    worker.start()
+    worker.startedAt = time.monotonic()
+    return worker
+
+def runCluster(host, port, workerCount, historyPath, brokerPath):
+    broker = multiprocessing.Process(target=runBroker, args=(brokerPath, historyPath))
+    broker.start()
+    workers = [startWorker(host, port, brokerPath) for _ in range(workerCount)]
+
+    signal.signal(signal.SIGTERM, signal.default_int_handler)
+    try:
+        while True:
+            ended = multiprocessing.connection.wait([broker.sentinel] + [worker.sentinel for worker in workers])
+
+            # Без брокера воркеры обслуживать клиентов не могут, поэтому кластер останавливается целиком.
+            if broker.sentinel in ended:
+                broker.join()
+                print(f"Брокер завершился с кодом {broker.exitcode}, сервер останавливается.")
+                break
+
+            # Упавший воркер заменяется новым, чтобы порт по-прежнему обслуживали workerCount процессов.
+            for workerIndex, worker in enumerate(workers):
+                if worker.sentinel not in ended:
+                    continue
+                worker.join()
+                print(f"Воркер {worker.pid} завершился с кодом {worker.exitcode}, запускается новый.")
+                # Воркер, падающий сразу после запуска, перезапускается не чаще раза в workerRestartDelay.
+                time.sleep(max(worker.startedAt + workerRestartDelay - time.monotonic(), 0))
+                workers[workerIndex] = startWorker(host, port, brokerPath)
+    except KeyboardInterrupt:
+        pass
+    finally:
+        # Брокер останавливается последним, чтобы успеть записать историю после всех воркеров.
+        for worker in workers:
+            worker.terminate()
+            worker.join()
+        broker.join(timeout=1)
+        if broker.is_alive():
+            broker.terminate()
+            broker.join()
+
+def main():
+    parser = argparse.ArgumentParser(description="Асинхронный чат-сервер.")
+    parser.add_argument("--host", default="0.0.0.0")
+    parser.add_argument("--port", type=int, default=5555)
+    parser.add_argument("--workers", type=int, default=1, help="число процессов-воркеров на общем порту")
+    parser.add_argument("--history", default="chatHistory.db", help="файл истории сообщений")
+    parser.add_argument("--brokerPath", default=None, help="Unix-сокет брокера для режима нескольких воркеров")
+    arguments = parser.parse_args()
+
+    if arguments.workers <= 1:
+        try:
+            asyncio.run(serve(arguments.host, arguments.port, historyPath=arguments.history))
+        except KeyboardInterrupt:
+            pass
+        return
 
-    async with server:
-        await server.serve_forever()
+    if not hasattr(socket, "SO_REUSEPORT") or not hasattr(socket, "AF_UNIX"):
+        parser.error("несколько воркеров требуют SO_REUSEPORT и Unix-сокетов")
+    brokerPath = arguments.brokerPath or os.path.join(tempfile.gettempdir(), f"chatBroker-{arguments.port}.sock")
+    runCluster(arguments.host, arguments.port, arguments.workers, arguments.history, brokerPath)
 
 
 if __name__ == "__main__":
-    asyncio.run(main())
+    main()
@@ -1,67 +1,277 @@
+import argparse
+import queue
+import selectors
 import socket
 import threading
-import pickle
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
 
-rooms = {}
+from chatProtocol import FrameDecoder, encodeFrame
 
-def handleClient(clientSocket):
-    while True:
-        try:
-            request = clientSocket.recv(1024)
-            if not request:
-                break
-
-            data = pickle.loads(request)
-            action = data.get("action")
-            room = data.get("room")
-            user = data.get("user")
-            message = data.get("message")
-            target_user = data.get("target_user")
-
-            if action == "create_room":
-                if room not in rooms:
-                    rooms[room] = {"messages": [], "users": []}
-                clientSocket.send(pickle.dumps({"status": "room_created"}))
-            
-            elif action == "create_private_room":
-                private_room_name = f"{user}_{target_user}_private"
-                if private_room_name not in rooms:
-                    rooms[private_room_name] = {"messages": [], "users": [user, target_user]}
-                clientSocket.send(pickle.dumps({"status": "private_room_created", "room_name": private_room_name}))
-
-            elif action == "get_rooms":
-                accessible_rooms = [room_name for room_name, room_data in rooms.items()
-                                    if "private" not in room_name or user in room_data["users"]]
-                clientSocket.send(pickle.dumps({"rooms": accessible_rooms}))
-
-            elif action == "send_message":
-                if room in rooms and (user in rooms[room]["users"] or "private" not in room):
-                    rooms[room]["messages"].append((user, message))
-                    clientSocket.send(pickle.dumps({"status": "message_sent"}))
-
-            elif action == "get_messages":
-                if room in rooms and (user in rooms[room]["users"] or "private" not in room):
-                    clientSocket.send(pickle.dumps({"messages": rooms[room]["messages"]}))
+workerCount = 8
+shardCount = 16
+maxOutgoingBytes = 1024 * 1024
+maxQueuedRequests = 1024
+
+class RoomShard:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.rooms = {}
+
+class RoomState:
+    # Комнаты разнесены по шардам со своими замками, так что запросы к разным комнатам не ждут друг друга.
+    # Список доступных комнат собирается из двух индексов, а не перебором всех комнат на каждый get_rooms.
+    def __init__(self, shardCount):
+        self.shards = [RoomShard() for _ in range(shardCount)]
+        self.indexLock = threading.Lock()
+        self.publicRooms = []
+        self.privateRoomsByUser = {}
+
+    def shard(self, room):
+        return self.shards[hash(room) % len(self.shards)]
+
+    def createRoom(self, room, users=None):
+        shard = self.shard(room)
+        with shard.lock:
+            if room in shard.rooms:
+                return False
+            shard.rooms[room] = {"messages": [], "users": set(users or ()), "private": users is not None}
+
+        with self.indexLock:
+            if users is None:
+                self.publicRooms.append(room)
+            else:
+                for user in set(users):
+                    self.privateRoomsByUser.setdefault(user, []).append(room)
+        return True
+
+    def accessibleRooms(self, user):
+        with self.indexLock:
+            return self.publicRooms + self.privateRoomsByUser.get(user, [])
+
+    def appendMessage(self, room, user, message):
+        shard = self.shard(room)
+        with shard.lock:
+            roomData = shard.rooms.get(room)
+            if roomData is None:
+                return "room_not_found"
+            if roomData["private"] and user not in roomData["users"]:
+                return "access_denied"
+            roomData["messages"].append((user, message))
+            return "message_sent"
+
+    def messages(self, room, user):
+        shard = self.shard(room)
+        with shard.lock:
+            roomData = shard.rooms.get(room)
+            if roomData is None or (roomData["private"] and user not in roomData["users"]):
+                return []
+            return list(roomData["messages"])
+
+rooms = RoomState(shardCount)
+
+def handleRequest(data):
+    action = data.get("action")
+    room = data.get("room")
+    user = data.get("user")
+    message = data.get("message")
+    target_user = data.get("target_user")
+
+    if action == "create_room":
+        rooms.createRoom(room)
+        return {"status": "room_created"}
+
+    elif action == "create_private_room":
+        private_room_name = f"{user}_{target_user}_private"
+        rooms.createRoom(private_room_name, [user, target_user])
+        return {"status": "private_room_created", "room_name": private_room_name}
+
+    elif action == "get_rooms":
+        return {"rooms": rooms.accessibleRooms(user)}
+
+    elif action == "send_message":
+        return {"status": rooms.appendMessage(room, user, message)}
+
+    elif action == "get_messages":
+        return {"messages": rooms.messages(room, user)}
+
+    return {"status": "unknown_action"}
+
+class Connection:
+    def __init__(self, clientSocket):
+        self.socket = clientSocket
+        self.decoder = FrameDecoder()
+        self.requests = deque()
+        self.outgoing = bytearray()
+        self.busy = False
+        self.closed = False
+        self.registeredEvents = selectors.EVENT_READ
+
+    def events(self):
+        # Пока клиент не забрал накопившиеся ответы или не обработаны его прежние запросы,
+        # новые запросы от него не читаются.
+        events = selectors.EVENT_WRITE if self.outgoing else 0
+        if len(self.outgoing) < maxOutgoingBytes and len(self.requests) < maxQueuedRequests:
+            events |= selectors.EVENT_READ
+        return events
+
+class ChatServer:
+    # Сокеты обслуживает один поток с селектором, а запросы выполняет ограниченный пул потоков,
+    # поэтому тысячи соединений не требуют тысяч потоков. У соединения одновременно в работе
+    # не больше одной пачки запросов, так что ответы уходят в порядке запросов.
+    def __init__(self, host, port):
+        self.selector = selectors.DefaultSelector()
+        self.workers = ThreadPoolExecutor(max_workers=workerCount)
+        self.completed = queue.Queue()
+        self.wakeReader, self.wakeWriter = socket.socketpair()
+        self.wakeReader.setblocking(False)
+        self.wakeWriter.setblocking(False)
+
+        self.server = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        self.server.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        self.server.bind((host, port))
+        self.server.listen(1024)
+        self.server.setblocking(False)
+
+        self.selector.register(self.server, selectors.EVENT_READ)
+        self.selector.register(self.wakeReader, selectors.EVENT_READ)
+
+    def serveForever(self):
+        while True:
+            for key, events in self.selector.select():
+                if key.fileobj is self.server:
+                    self.acceptConnections()
+                elif key.fileobj is self.wakeReader:
+                    self.finishBatches()
                 else:
-                    clientSocket.send(pickle.dumps({"messages": []}))
-                    
+                    if events & selectors.EVENT_READ:
+                        self.readConnection(key.data)
+                    if events & selectors.EVENT_WRITE:
+                        self.writeConnection(key.data)
+
+    def acceptConnections(self):
+        while True:
+            try:
+                clientSocket, addr = self.server.accept()
+            except BlockingIOError:
+                return
+            print(f"New connection: {addr}")
+            clientSocket.setblocking(False)
+            connection = Connection(clientSocket)
+            self.selector.register(clientSocket, connection.registeredEvents, connection)
+
+    def readConnection(self, connection):
+        try:
+            data = connection.socket.recv(65536)
+            if not data:
+                self.closeConnection(connection)
+                return
+            connection.requests.extend(connection.decoder.feed(data))
+        except BlockingIOError:
+            return
         except Exception as e:
             print(f"Error: {e}")
-            break
-    
-    clientSocket.close()
-
-def startServer():
-    server = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-    server.bind(("0.0.0.0", 5555))
-    server.listen(5)
-    print("Server started...")
+            self.closeConnection(connection)
+            return
+
+        self.submitBatch(connection)
+        self.updateEvents(connection)
+
+    def submitBatch(self, connection):
+        if connection.busy or not connection.requests or connection.closed:
+            return
+
+        batch = list(connection.requests)
+        connection.requests.clear()
+        connection.busy = True
+        self.workers.submit(self.processBatch, connection, batch)
+
+    def processBatch(self, connection, batch):
+        try:
+            output = b"".join(encodeFrame(handleRequest(request)) for request in batch)
+        except Exception as e:
+            print(f"Error: {e}")
+            output = None
+
+        self.completed.put((connection, output))
+        try:
+            self.wakeWriter.send(b"\0")
+        except BlockingIOError:
+            pass
+
+    def finishBatches(self):
+        try:
+            while self.wakeReader.recv(4096):
+                pass
+        except BlockingIOError:
+            pass
+
+        while True:
+            try:
+                connection, output = self.completed.get_nowait()
+            except queue.Empty:
+                return
 
-    while True:
-        clientSocket, addr = server.accept()
-        print(f"New connection: {addr}")
-        clientHandler = threading.Thread(target=handleClient, args=(clientSocket,))
-        clientHandler.start()
+            connection.busy = False
+            if connection.closed:
+                continue
+            if output is None:
+                self.closeConnection(connection)
+                continue
+
+            connection.outgoing += output
+            self.writeConnection(connection)
+
+    def writeConnection(self, connection):
+        try:
+            if connection.outgoing:
+                sent = connection.socket.send(connection.outgoing)
+                del connection.outgoing[:sent]
+        except BlockingIOError:
+            pass
+        except Exception as e:
+            print(f"Error: {e}")
+            self.closeConnection(connection)
+            return
+
+        self.submitBatch(connection)
+        self.updateEvents(connection)
+
+    def updateEvents(self, connection):
+        events = connection.events()
+        if events == connection.registeredEvents or connection.closed:
+            return
+
+        # Пустую маску селектор не принимает (SelectSelector в Windows бросает ValueError), поэтому соединение,
+        # которому нечего отправить и некуда читать, снимается с учёта до завершения его пачки запросов.
+        if not events:
+            self.selector.unregister(connection.socket)
+        elif not connection.registeredEvents:
+            self.selector.register(connection.socket, events, connection)
+        else:
+            self.selector.modify(connection.socket, events, connection)
+        connection.registeredEvents = events
+
+    def closeConnection(self, connection):
+        if connection.closed:
+            return
+        connection.closed = True
+        if connection.registeredEvents:
+            self.selector.unregister(connection.socket)
+        connection.socket.close()
+
+def startServer(host="0.0.0.0", port=5555):
+    server = ChatServer(host, port)
+    print("Server started...")
+    server.serveForever()
 
 if __name__ == "__main__":
-    startServer()
+    parser = argparse.ArgumentParser(description="Threaded chat server.")
+    parser.add_argument("--host", default="0.0.0.0")
+    parser.add_argument("--port", type=int, default=5555)
+    arguments = parser.parse_args()
+
+    try:
+        startServer(arguments.host, arguments.port)
+    except KeyboardInterrupt:
+        pass
@@ -0,0 +1,430 @@
+import argparse
+import bisect
+import heapq
+import json
+import mmap
+import os
+import re
+import shutil
+import struct
+import tempfile
+from array import array
+from collections.abc import Mapping
+
+tokenPattern = re.compile(r"\w+")
+
+catalogMagic = b"BOOKCAT1"
+bookFields = ("title", "author", "genre", "first_publish_year", "description")
+
+# Секции бинарного каталога в порядке записи и формат их элементов (модуль array).
+catalogSections = (
+    ("stringOffsets", "Q"),
+    ("stringData", "B"),
+    ("titles", "I"),
+    ("descriptions", "I"),
+    ("genres", "I"),
+    ("years", "i"),
+    ("bookAuthorOffsets", "Q"),
+    ("bookAuthors", "I"),
+    ("genreKeys", "I"),
+    ("genreOffsets", "Q"),
+    ("genrePostings", "I"),
+    ("authorKeys", "I"),
+    ("authorOffsets", "Q"),
+    ("authorPostings", "I"),
+    ("tokenKeys", "I"),
+    ("tokenOffsets", "Q"),
+    ("tokenPostings", "I"),
+    ("titleOrder", "I"),
+    ("yearOrder", "I"),
+)
+
+class BookIndex:
+    def __init__(self, books, catalog=None, compactionRatio=0.25):
+        self.compactionRatio = compactionRatio
+        # Растёт при каждом уплотнении: по нему производные структуры понимают, что id книг сменились.
+        self.generation = 0
+
+        if catalog is not None:
+            self.books = books
+            self.bookIds = None
+            self.removedIds = set()
+            self.lowerDescriptions = catalog.lowerDescriptions
+            self.genreIndex = catalog.genreIndex
+            self.authorIndex = catalog.authorIndex
+            self.tokenIndex = catalog.tokenIndex
+            self.years = catalog.years
+            self.titleOrder = catalog.titleOrder
+            self.yearOrder = catalog.yearOrder
+            return
+
+        self.buildIndex(books)
+
+    def buildIndex(self, books):
+        self.books = books
+        self.bookIds = None
+        self.removedIds = set()
+        self.lowerDescriptions = []
+        self.genreIndex = {}
+        self.authorIndex = {}
+        self.tokenIndex = {}
+        self.years = []
+
+        for bookId, book in enumerate(books):
+            self.addToIndex(bookId, book)
+
+        self.titleOrder = sorted(range(len(books)), key=lambda bookId: books[bookId]["title"])
+        self.yearOrder = sorted(range(len(books)), key=self.years.__getitem__)
+
+    def tokenize(self, text):
+        return tokenPattern.findall(text)
+
+    def addToIndex(self, bookId, book):
+        description = book["description"].lower()
+        self.lowerDescriptions.append(description)
+        self.years.append(book["first_publish_year"])
+
+        self.addPosting(self.genreIndex, book["genre"].lower(), bookId)
+
+        for author in book["author"]:
+            self.addPosting(self.authorIndex, author.lower(), bookId)
+
+        for token in set(self.tokenize(description)):
+            self.addPosting(self.tokenIndex, token, bookId)
+
+    def addPosting(self, index, key, bookId):
+        bookIds = index.get(key)
+        if bookIds is None:
+            index[key] = [bookId]
+            return
+
+        if isinstance(bookIds, memoryview):
+            bookIds = index[key] = list(bookIds)
+        bookIds.append(bookId)
+
+    def ingest(self, records):
+        if self.bookIds is None:
+            self.bookIds = {bookKey(self.books[bookId]): bookId for bookId in range(len(self.books))
+                            if bookId not in self.removedIds}
+
+        # Столбцы из отображённого файла доступны только для чтения, копируем их при первой записи.
+        if isinstance(self.years, memoryview):
+            self.years = array("i", self.years)
+            self.titleOrder = array("I", self.titleOrder)
+            self.yearOrder = array("I", self.yearOrder)
+
+        addedIds = []
+
+        for record in records:
+            key = bookKey(record)
+            isRemoval = record.get("action") == "remove"
+            book = None if isRemoval else {field: record[field] for field in bookFields}
+
+            # Обновление и удаление помечают старую запись удалённой; её id остаётся в индексах
+            # и отсеивается при подсчёте оценок, а перестраиваются индексы только при уплотнении.
+            oldId = self.bookIds.pop(key, None)
+            if oldId is not None:
+                self.removedIds.add(oldId)
+
+            if isRemoval:
+                continue
+
+            bookId = len(self.books)
+            self.books.append(book)
+            self.addToIndex(bookId, book)
+
+            bisect.insort(self.titleOrder, bookId, key=lambda otherId: self.books[otherId]["title"])
+            bisect.insort(self.yearOrder, bookId, key=self.years.__getitem__)
+
+            self.bookIds[key] = bookId
+            addedIds.append(bookId)
+
+        if len(self.removedIds) > self.compactionRatio * len(self.books):
+            newIds = self.compact()
+            addedIds = [newIds[bookId] for bookId in addedIds if bookId in newIds]
+
+        return addedIds
+
+    def compact(self):
+        # Удалённые и заменённые записи копятся в индексах и порядках сортировки, поэтому когда их доля
+        # превышает порог, индекс строится заново только по живым книгам. Возвращает отображение старых id в новые.
+        liveIds = [bookId for bookId in range(len(self.books)) if bookId not in self.removedIds]
+        self.buildIndex([dict(self.books[bookId]) for bookId in liveIds])
+        self.generation += 1
+        return {oldId: newId for newId, oldId in enumerate(liveIds)}
+
+    def findKeyword(self, keyword):
+        keywordTokens = self.tokenize(keyword)
+        if not keywordTokens:
+            return [bookId for bookId, description in enumerate(self.lowerDescriptions) if keyword in description]
+
+        # Подстрока из букв и цифр всегда лежит внутри одного токена описания,
+        # поэтому кандидатов можно искать по словарю, а не по всем описаниям.
+        candidates = None
+        for keywordToken in keywordTokens:
+            tokenCandidates = set()
+            for token, bookIds in self.tokenIndex.items():
+                if keywordToken in token:
+                    tokenCandidates.update(bookIds)
+            candidates = tokenCandidates if candidates is None else candidates & tokenCandidates
+
+        if keywordTokens == [keyword]:
+            return candidates
+
+        return [bookId for bookId in candidates if keyword in self.lowerDescriptions[bookId]]
+
+    def calculateScores(self, genres, authors, keywords):
+        scores = {}
+
+        for genre in set(genres):
+            for bookId in self.genreIndex.get(genre, ()):
+                scores[bookId] = scores.get(bookId, 0) + 3
+
+        for author in set(authors):
+            for bookId in self.authorIndex.get(author, ()):
+                scores[bookId] = scores.get(bookId, 0) + 2
+
+        for keyword in keywords:
+            for bookId in self.findKeyword(keyword):
+                scores[bookId] = scores.get(bookId, 0) + 1
+
+        if self.removedIds:
+            scores = {bookId: score for bookId, score in scores.items() if bookId not in self.removedIds}
+
+        return scores
+
+    def calculateScoresBatch(self, profiles):
+        return [self.calculateScores(genres, authors, keywords) for genres, authors, keywords in profiles]
+
+    def selectInOrder(self, field, bookIds, count):
+        if field == "title":
+            order = self.titleOrder
+            sortKey = lambda bookId: (self.books[bookId]["title"], bookId)
+        else:
+            order = self.yearOrder
+            sortKey = lambda bookId: (self.years[bookId], bookId)
+
+        # Если кандидатов мало, дешевле отобрать их кучей, чем идти по всему порядку.
+        if len(bookIds) * 8 < len(order):
+            if count is None:
+                return sorted(bookIds, key=sortKey)
+            return heapq.nsmallest(count, bookIds, key=sortKey)
+
+        selected = []
+        for bookId in order:
+            if bookId in bookIds:
+                selected.append(bookId)
+                if len(selected) == count:
+                    break
+
+        return selected
+
+class MappedBook(Mapping):
+    def __init__(self, catalog, bookId):
+        self.catalog = catalog
+        self.bookId = bookId
+
+    def __getitem__(self, field):
+        catalog = self.catalog
+        bookId = self.bookId
+
+        if field == "title":
+            return catalog.string(catalog.titles[bookId])
+        if field == "description":
+            return catalog.string(catalog.descriptions[bookId])
+        if field == "genre":
+            return catalog.string(catalog.genres[bookId])
+        if field == "first_publish_year":
+            return catalog.years[bookId]
+        if field == "author":
+            start, end = catalog.bookAuthorOffsets[bookId], catalog.bookAuthorOffsets[bookId + 1]
+            return [catalog.string(stringId) for stringId in catalog.bookAuthors[start:end]]
+        raise KeyError(field)
+
+    def __iter__(self):
+        return iter(bookFields)
+
+    def __len__(self):
+        return len(bookFields)
+
+class MappedBooks:
+    def __init__(self, catalog):
+        self.catalog = catalog
+        self.appended = []
+
+    def __len__(self):
+        return len(self.catalog.titles) + len(self.appended)
+
+    def __getitem__(self, bookId):
+        if not 0 <= bookId < len(self):
+            raise IndexError(bookId)
+        if bookId >= len(self.catalog.titles):
+            return self.appended[bookId - len(self.catalog.titles)]
+        return MappedBook(self.catalog, bookId)
+
+    def append(self, book):
+        self.appended.append(book)
+
+class MappedDescriptions:
+    def __init__(self, catalog):
+        self.catalog = catalog
+        self.appended = []
+
+    def __len__(self):
+        return len(self.catalog.descriptions) + len(self.appended)
+
+    def __getitem__(self, bookId):
+        if not 0 <= bookId < len(self):
+            raise IndexError(bookId)
+        if bookId >= len(self.catalog.descriptions):
+            return self.appended[bookId - len(self.catalog.descriptions)]
+        return self.catalog.string(self.catalog.descriptions[bookId]).lower()
+
+    def append(self, description):
+        self.appended.append(description)
+
+class MappedCatalog:
+    def __init__(self, path):
+        with open(path, "rb") as file:
+            self.buffer = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+
+        view = memoryview(self.buffer)
+        if view[:len(catalogMagic)] != catalogMagic:
+            raise ValueError(f"{path} не является бинарным каталогом книг.")
+
+        headerFormat = "=" + "QQ" * len(catalogSections)
+        header = struct.unpack_from(headerFormat, self.buffer, len(catalogMagic))
+
+        for sectionIndex, (name, itemFormat) in enumerate(catalogSections):
+            offset, length = header[2 * sectionIndex], header[2 * sectionIndex + 1]
+            setattr(self, name, view[offset:offset + length].cast(itemFormat))
+
+        self.books = MappedBooks(self)
+        self.lowerDescriptions = MappedDescriptions(self)
+        self.genreIndex = self.postingsIndex(self.genreKeys, self.genreOffsets, self.genrePostings)
+        self.authorIndex = self.postingsIndex(self.authorKeys, self.authorOffsets, self.authorPostings)
+        self.tokenIndex = self.postingsIndex(self.tokenKeys, self.tokenOffsets, self.tokenPostings)
+
+    def string(self, stringId):
+        return str(self.stringData[self.stringOffsets[stringId]:self.stringOffsets[stringId + 1]], "utf-8")
+
+    def postingsIndex(self, keys, offsets, postings):
+        return {self.string(stringId): postings[offsets[keyIndex]:offsets[keyIndex + 1]]
+                for keyIndex, stringId in enumerate(keys)}
+
+def bookKey(book):
+    return book["title"], tuple(book["author"])
+
+def readBookRecords(path):
+    with open(path, "r", encoding="utf-8") as file:
+        for line in file:
+            if line.strip():
+                yield json.loads(line)
+
+def writeCatalog(books, path):
+    # Книги читаются из итератора по одной и нигде не накапливаются: в памяти остаются только столбцы
+    # и списки вхождений в компактных массивах, а текст строк сразу уходит во временный файл.
+    sections = {name: array(itemFormat) for name, itemFormat in catalogSections if name != "stringData"}
+    sections["stringOffsets"].append(0)
+    sections["bookAuthorOffsets"].append(0)
+    stringIds = {}
+    genreIndex, authorIndex, tokenIndex = {}, {}, {}
+    titles = []
+
+    with tempfile.TemporaryFile(dir=os.path.dirname(os.path.abspath(path))) as stringData:
+        def addString(text):
+            stringData.write(text.encode("utf-8"))
+            sections["stringOffsets"].append(stringData.tell())
+            return len(sections["stringOffsets"]) - 2
+
+        # Повторяются только жанры, авторы и ключи индексов; названия и описания пишутся без словаря,
+        # иначе он держал бы в памяти весь текст каталога.
+        def internString(text):
+            if text not in stringIds:
+                stringIds[text] = addString(text)
+            return stringIds[text]
+
+        def addPosting(index, key, bookId):
+            bookIds = index.get(key)
+            if bookIds is None:
+                bookIds = index[key] = array("I")
+            bookIds.append(bookId)
+
+        def postingsSections(index):
+            keys = array("I")
+            offsets = array("Q", [0])
+            postings = array("I")
+            for key, bookIds in index.items():
+                keys.append(internString(key))
+                postings.extend(bookIds)
+                offsets.append(len(postings))
+            return keys, offsets, postings
+
+        for bookId, book in enumerate(books):
+            titles.append(book["title"])
+            sections["titles"].append(addString(book["title"]))
+            sections["descriptions"].append(addString(book["description"]))
+            sections["genres"].append(internString(book["genre"]))
+            sections["years"].append(book["first_publish_year"])
+            sections["bookAuthors"].extend(internString(author) for author in book["author"])
+            sections["bookAuthorOffsets"].append(len(sections["bookAuthors"]))
+
+            addPosting(genreIndex, book["genre"].lower(), bookId)
+            for author in book["author"]:
+                addPosting(authorIndex, author.lower(), bookId)
+            for token in set(tokenPattern.findall(book["description"].lower())):
+                addPosting(tokenIndex, token, bookId)
+
+        sections["genreKeys"], sections["genreOffsets"], sections["genrePostings"] = postingsSections(genreIndex)
+        sections["authorKeys"], sections["authorOffsets"], sections["authorPostings"] = postingsSections(authorIndex)
+        sections["tokenKeys"], sections["tokenOffsets"], sections["tokenPostings"] = postingsSections(tokenIndex)
+        sections["titleOrder"].extend(sorted(range(len(titles)), key=titles.__getitem__))
+        del titles
+        sections["yearOrder"].extend(sorted(range(len(sections["years"])), key=sections["years"].__getitem__))
+
+        stringDataSize = stringData.tell()
+        headerSize = len(catalogMagic) + struct.calcsize("=" + "QQ" * len(catalogSections))
+        header = []
+        paddings = []
+        position = headerSize
+        for name, _ in catalogSections:
+            # Секции выравниваются по 8 байтам, чтобы memoryview.cast читал их без копирования.
+            paddings.append(-position % 8)
+            position += paddings[-1]
+            size = stringDataSize if name == "stringData" else len(sections[name]) * sections[name].itemsize
+            header.extend((position, size))
+            position += size
+
+        with open(path, "wb") as file:
+            file.write(catalogMagic)
+            file.write(struct.pack("=" + "QQ" * len(catalogSections), *header))
+            for (name, _), padding in zip(catalogSections, paddings):
+                file.write(bytes(padding))
+                if name == "stringData":
+                    stringData.seek(0)
+                    shutil.copyfileobj(stringData, file)
+                else:
+                    sections[name].tofile(file)
+
+def loadCatalog(jsonPath, binaryPath):
+    # Бинарный каталог используется, только если он не старше исходного JSON.
+    if os.path.exists(binaryPath) and (not os.path.exists(jsonPath)
+                                       or os.path.getmtime(binaryPath) >= os.path.getmtime(jsonPath)):
+        catalog = MappedCatalog(binaryPath)
+        return BookIndex(catalog.books, catalog)
+
+    with open(jsonPath, "r", encoding="utf-8") as file:
+        books = json.load(file)
+
+    return BookIndex(books)
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Конвертирует books.json в бинарный каталог для быстрого запуска.")
+    parser.add_argument("jsonPath", nargs="?", default="books.json")
+    parser.add_argument("binaryPath", nargs="?", default="books.bin")
+    arguments = parser.parse_args()
+
+    with open(arguments.jsonPath, "r", encoding="utf-8") as file:
+        writeCatalog(json.load(file), arguments.binaryPath)
+
+    print(f"Каталог записан в {arguments.binaryPath}")
@@ -0,0 +1,160 @@
+import heapq
+import time
+from collections import OrderedDict
+
+from BookCatalog import loadCatalog
+from RelevanceRanker import Bm25Ranker
+
+try:
+    from VectorScorer import VectorScorer
+except ImportError:
+    VectorScorer = None
+
+relevanceSort = "Релевантность"
+
+def splitList(items):
+    if isinstance(items, str):
+        items = items.split(",")
+    return [item.strip().lower() for item in items if item.strip()]
+
+def normalizeQuery(genres, authors, keywords, yearFilter, sortBy):
+    # Жанры и авторы учитываются по одному разу, а ключевые слова — с повторами,
+    # поэтому повторы убираются только у первых двух.
+    return (tuple(sorted(set(splitList(genres)))),
+            tuple(sorted(set(splitList(authors)))),
+            tuple(sorted(splitList(keywords))),
+            yearFilter or None,
+            sortBy)
+
+class QueryCache:
+    def __init__(self, maxSize=1024, ttl=300):
+        self.maxSize = maxSize
+        self.ttl = ttl
+        self.entries = OrderedDict()
+
+    def get(self, key):
+        entry = self.entries.get(key)
+        if entry is None:
+            return None
+
+        value, expiresAt = entry
+        if expiresAt < time.monotonic():
+            del self.entries[key]
+            return None
+
+        self.entries.move_to_end(key)
+        return value
+
+    def put(self, key, value):
+        self.entries[key] = (value, time.monotonic() + self.ttl)
+        self.entries.move_to_end(key)
+
+        while len(self.entries) > self.maxSize:
+            self.entries.popitem(last=False)
+
+    def clear(self):
+        self.entries.clear()
+
+class RecommendationEngine:
+    def __init__(self, bookIndex, cacheSize=1024, cacheTtl=300):
+        self.bookIndex = bookIndex
+        self.scorer = VectorScorer(bookIndex) if VectorScorer else bookIndex
+        self.cache = QueryCache(cacheSize, cacheTtl)
+        self.ranker = None
+
+    def recommend(self, genres, authors, keywords, yearFilter, sortBy, limit=None, offset=0):
+        return self.recommendBatch([{"genres": genres, "authors": authors, "keywords": keywords,
+                                     "yearFilter": yearFilter, "sortBy": sortBy,
+                                     "limit": limit, "offset": offset}])[0]
+
+    def recommendBatch(self, queries):
+        keys = []
+        results = {}
+        missingKeys = []
+
+        for query in queries:
+            normalizedQuery = normalizeQuery(query.get("genres", ""), query.get("authors", ""),
+                                             query.get("keywords", ""), query.get("yearFilter"),
+                                             query.get("sortBy", "Рейтинг"))
+            limit, offset = query.get("limit"), query.get("offset", 0)
+            # Отрицательные значения срез списка понял бы как отсчёт с конца, а не как ошибку.
+            if offset < 0 or (limit is not None and limit < 0):
+                raise ValueError(f"limit и offset не могут быть отрицательными: limit={limit}, offset={offset}")
+            key = (normalizedQuery, limit, offset)
+            keys.append(key)
+
+            if key not in results:
+                results[key] = self.cache.get(key)
+                if results[key] is None:
+                    missingKeys.append(key)
+
+        # Промахи кэша оцениваются одним пакетом, чтобы векторный движок сделал одно умножение матриц.
+        # В режиме релевантности ключевые слова оцениваются BM25, а не поиском подстроки.
+        profiles = [(genres, authors, () if sortBy == relevanceSort else keywords)
+                    for (genres, authors, keywords, _, sortBy), _, _ in missingKeys]
+        for key, scores in zip(missingKeys, self.scorer.calculateScoresBatch(profiles)):
+            (_, _, keywords, yearFilter, sortBy), limit, offset = key
+            if sortBy == relevanceSort:
+                scores = self.addRelevance(scores, keywords)
+            results[key] = self.selectBooks(scores, yearFilter, sortBy, limit, offset)
+            self.cache.put(key, results[key])
+
+        return [results[key] for key in keys]
+
+    def addRelevance(self, scores, keywords):
+        if self.ranker is None:
+            self.ranker = Bm25Ranker(self.bookIndex)
+
+        scores = dict(scores)
+        for bookId, relevance in self.ranker.calculateScores(keywords).items():
+            scores[bookId] = scores.get(bookId, 0) + relevance
+
+        return scores
+
+    def selectBooks(self, scores, yearFilter, sortBy, limit, offset):
+        bookIndex = self.bookIndex
+
+        if yearFilter:
+            scores = {bookId: score for bookId, score in scores.items()
+                      if bookIndex.years[bookId] >= yearFilter}
+
+        count = offset + limit if limit is not None else None
+        if count == 0:
+            return []
+
+        if sortBy in ("Рейтинг", relevanceSort):
+            ratingKey = lambda bookId: (-scores[bookId], bookId)
+            selected = sorted(scores, key=ratingKey) if count is None else heapq.nsmallest(count, scores, key=ratingKey)
+        elif sortBy == "Алфавит":
+            selected = bookIndex.selectInOrder("title", scores, count)
+        elif sortBy == "Год":
+            selected = bookIndex.selectInOrder("first_publish_year", scores, count)
+        else:
+            selected = sorted(scores) if count is None else heapq.nsmallest(count, scores)
+
+        recommendations = []
+
+        for bookId in selected[offset:]:
+            book = bookIndex.books[bookId]
+            recommendations.append({
+                "title": book["title"],
+                "author": ", ".join(book["author"]),
+                "genre": book["genre"],
+                "year": book["first_publish_year"],
+                "score": round(scores[bookId], 3)
+            })
+
+        return recommendations
+
+    def ingest(self, records):
+        generation = self.bookIndex.generation
+        try:
+            return self.scorer.ingest(records)
+        finally:
+            self.cache.clear()
+            # BM25 дописывает только новые книги, поэтому после уплотнения индекса его нужно собрать заново.
+            if self.bookIndex.generation != generation:
+                self.ranker = None
+
+def loadEngine(jsonPath="books.json", binaryPath="books.bin", cacheSize=1024, cacheTtl=300):
+    return RecommendationEngine(loadCatalog(jsonPath, binaryPath), cacheSize, cacheTtl)
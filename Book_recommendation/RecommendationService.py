@@ -0,0 +1,83 @@
+import argparse
+import asyncio
+import json
+
+from RecommendationEngine import loadEngine
+
+httpStatuses = {200: "OK", 400: "Bad Request", 404: "Not Found", 405: "Method Not Allowed"}
+
+class RecommendationService:
+    def __init__(self, engine):
+        self.engine = engine
+
+    def handleRequest(self, method, path, body):
+        if path not in ("/recommend", "/ingest"):
+            return 404, {"error": "Неизвестный адрес."}
+        if method != "POST":
+            return 405, {"error": "Поддерживается только POST."}
+
+        try:
+            payload = json.loads(body or b"{}")
+            if path == "/recommend":
+                return 200, {"results": self.engine.recommendBatch(payload["queries"])}
+            return 200, {"added": len(self.engine.ingest(payload["records"]))}
+        except (ValueError, KeyError, TypeError, AttributeError) as error:
+            return 400, {"error": f"Некорректный запрос: {error!r}"}
+
+    async def handleClient(self, reader, writer):
+        try:
+            while True:
+                requestLine = await reader.readline()
+                if not requestLine:
+                    break
+
+                method, path, _ = requestLine.decode("latin-1").split(" ", 2)
+
+                headers = {}
+                while True:
+                    line = await reader.readline()
+                    if line in (b"\r\n", b"\n", b""):
+                        break
+                    name, _, value = line.decode("latin-1").partition(":")
+                    headers[name.strip().lower()] = value.strip()
+
+                body = await reader.readexactly(int(headers.get("content-length", 0)))
+
+                # Движок и его кэш не потокобезопасны, поэтому пакет обрабатывается прямо в цикле событий.
+                status, response = self.handleRequest(method, path, body)
+
+                data = json.dumps(response, ensure_ascii=False).encode("utf-8")
+                writer.write((f"HTTP/1.1 {status} {httpStatuses[status]}\r\n"
+                              f"Content-Type: application/json; charset=utf-8\r\n"
+                              f"Content-Length: {len(data)}\r\n\r\n").encode("latin-1") + data)
+                await writer.drain()
+
+                if headers.get("connection", "").lower() == "close":
+                    break
+
+        except (ValueError, asyncio.IncompleteReadError, ConnectionError) as e:
+            print(f"Ошибка соединения: {e}")
+        finally:
+            writer.close()
+            await writer.wait_closed()
+
+async def main(arguments):
+    engine = loadEngine(arguments.json, arguments.binary, arguments.cacheSize, arguments.cacheTtl)
+    service = RecommendationService(engine)
+
+    server = await asyncio.start_server(service.handleClient, arguments.host, arguments.port)
+    print(f"Сервис рекомендаций запущен на {arguments.host}:{arguments.port}...")
+
+    async with server:
+        await server.serve_forever()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="HTTP-сервис пакетных рекомендаций книг.")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8080)
+    parser.add_argument("--json", default="books.json")
+    parser.add_argument("--binary", default="books.bin")
+    parser.add_argument("--cacheSize", type=int, default=1024)
+    parser.add_argument("--cacheTtl", type=float, default=300)
+    asyncio.run(main(parser.parse_args()))
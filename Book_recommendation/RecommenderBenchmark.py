@@ -0,0 +1,188 @@
+import argparse
+import contextlib
+import json
+import multiprocessing
+import os
+import random
+import resource
+import sys
+import tempfile
+import time
+
+from BookCatalog import writeCatalog
+from RecommendationEngine import loadEngine, relevanceSort
+
+genres = ["Science Fiction", "Mystery", "Non-Fiction", "Romance", "Fantasy",
+          "Adventure", "Children's Literature", "Classic Literature"]
+sortModes = ["Рейтинг", relevanceSort, "Алфавит", "Год"]
+
+def syllableWords(randomGenerator, count):
+    syllables = ["ka", "lo", "mer", "tin", "sa", "vor", "el", "dra", "qui", "pan", "ros", "te", "um", "zen", "hol"]
+    words = set()
+    while len(words) < count:
+        words.add("".join(randomGenerator.choice(syllables) for _ in range(randomGenerator.randint(1, 4))))
+    return sorted(words)
+
+def generateBooks(bookCount, seed=0, vocabularySize=20000):
+    randomGenerator = random.Random(seed)
+    vocabulary = syllableWords(randomGenerator, vocabularySize)
+    authorCount = max(bookCount // 5, 10)
+    authors = [f"{vocabulary[authorId % vocabularySize].title()} {vocabulary[authorId // vocabularySize].title()}"
+               for authorId in range(authorCount)]
+
+    for bookId in range(bookCount):
+        # Частоты слов и авторов распределены неравномерно, как в настоящем каталоге.
+        description = " ".join(vocabulary[int(randomGenerator.paretovariate(1.1)) % vocabularySize]
+                               for _ in range(randomGenerator.randint(20, 120)))
+        yield {
+            "title": " ".join(randomGenerator.choice(vocabulary) for _ in range(randomGenerator.randint(1, 5))).title(),
+            "author": [authors[int(randomGenerator.paretovariate(1.2)) % len(authors)]
+                       for _ in range(1 if randomGenerator.random() < 0.8 else randomGenerator.randint(2, 4))],
+            "genre": randomGenerator.choice(genres),
+            "first_publish_year": randomGenerator.randint(1500, 2024),
+            "description": description.capitalize() + "."
+        }
+
+def streamBooks(books, sample, seed=0, jsonFile=None, sampleSize=1000):
+    # Пропускает книги дальше по одной, попутно дописывая их в JSON и собирая равномерную выборку
+    # для запросов (reservoir sampling), так что весь каталог ни в какой момент не лежит в памяти.
+    randomGenerator = random.Random(seed)
+    if jsonFile is not None:
+        jsonFile.write("[")
+
+    for bookId, book in enumerate(books):
+        if jsonFile is not None:
+            if bookId:
+                jsonFile.write(",")
+            json.dump(book, jsonFile, ensure_ascii=False)
+
+        if len(sample) < sampleSize:
+            sample.append(book)
+        else:
+            sampleIndex = randomGenerator.randrange(bookId + 1)
+            if sampleIndex < sampleSize:
+                sample[sampleIndex] = book
+        yield book
+
+    if jsonFile is not None:
+        jsonFile.write("]")
+
+def generateQueries(sample, queryCount, seed=0, limit=50):
+    randomGenerator = random.Random(seed)
+    queries = []
+
+    for _ in range(queryCount):
+        book = randomGenerator.choice(sample)
+        words = book["description"].rstrip(".").split()
+        queries.append({
+            "genres": ",".join(randomGenerator.sample(genres, randomGenerator.randint(0, 3))),
+            "authors": ",".join(randomGenerator.choice(sample)["author"][0] for _ in range(randomGenerator.randint(0, 2))),
+            "keywords": ",".join(randomGenerator.choice(words) for _ in range(randomGenerator.randint(0, 3))),
+            "yearFilter": randomGenerator.choice([None, None, 1800, 1900, 1950, 2000]),
+            "sortBy": randomGenerator.choice(sortModes),
+            "limit": limit,
+            "offset": 0
+        })
+
+    return queries
+
+def percentile(values, fraction):
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(fraction * len(ordered)))]
+
+def peakMemoryMegabytes():
+    # ru_maxrss наследуется через execve от родителя, поэтому в Linux берём VmHWM своего процесса.
+    if os.path.exists("/proc/self/status"):
+        with open("/proc/self/status") as file:
+            for line in file:
+                if line.startswith("VmHWM:"):
+                    return int(line.split()[1]) / 1024
+
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # В Linux ru_maxrss указан в килобайтах, в macOS — в байтах.
+    return peak / (1024 * 1024) if sys.platform == "darwin" else peak / 1024
+
+def runBenchmark(catalogPath, catalogFormat, queries, batchSize):
+    jsonPath, binaryPath = (catalogPath, catalogPath + ".missing") if catalogFormat == "json" else (catalogPath + ".missing", catalogPath)
+
+    startTime = time.perf_counter()
+    engine = loadEngine(jsonPath, binaryPath, cacheSize=0)
+    loadTime = time.perf_counter() - startTime
+
+    # Пакет считается одним умножением матриц, и время отдельного запроса внутри него не определено,
+    # поэтому перцентили берутся по вызовам recommendBatch: при batchSize > 1 это задержка целого пакета.
+    latencies = []
+    startTime = time.perf_counter()
+    for batchStart in range(0, len(queries), batchSize):
+        batch = queries[batchStart:batchStart + batchSize]
+        callStart = time.perf_counter()
+        engine.recommendBatch(batch)
+        latencies.append(time.perf_counter() - callStart)
+    totalTime = time.perf_counter() - startTime
+
+    return {
+        "catalogFormat": catalogFormat,
+        "books": len(engine.bookIndex.books),
+        "queries": len(queries),
+        "batchSize": batchSize,
+        "loadSeconds": round(loadTime, 4),
+        "latencyPer": "query" if batchSize == 1 else "batch",
+        "p50Milliseconds": round(percentile(latencies, 0.5) * 1000, 3),
+        "p99Milliseconds": round(percentile(latencies, 0.99) * 1000, 3),
+        "meanQueryMilliseconds": round(totalTime / len(queries) * 1000, 3) if queries else None,
+        "queriesPerSecond": round(len(queries) / totalTime, 1) if totalTime else None,
+        "peakMemoryMegabytes": round(peakMemoryMegabytes(), 1)
+    }
+
+def runIsolated(resultQueue, *arguments):
+    resultQueue.put(runBenchmark(*arguments))
+
+def benchmarkCatalogSize(bookCount, arguments, workDirectory):
+    # Книги генерируются один раз и сразу уходят в оба файла каталога; JSON пишется, только если его замеряют,
+    # потому что на миллионах книг он уже не загружается в память целиком.
+    jsonPath = os.path.join(workDirectory, f"books_{bookCount}.json")
+    binaryPath = os.path.join(workDirectory, f"books_{bookCount}.bin")
+    sample = []
+    jsonContext = open(jsonPath, "w", encoding="utf-8") if "json" in arguments.formats else contextlib.nullcontext()
+    with jsonContext as jsonFile:
+        writeCatalog(streamBooks(generateBooks(bookCount, arguments.seed), sample, arguments.seed, jsonFile), binaryPath)
+    queries = generateQueries(sample, arguments.queries, arguments.seed)
+
+    results = []
+    context = multiprocessing.get_context("spawn")
+    catalogPaths = {"json": jsonPath, "binary": binaryPath}
+    for catalogFormat in arguments.formats:
+        catalogPath = catalogPaths[catalogFormat]
+        # Каждый замер идёт в отдельном процессе, чтобы пиковая память не смешивалась между прогонами.
+        resultQueue = context.Queue()
+        process = context.Process(target=runIsolated,
+                                  args=(resultQueue, catalogPath, catalogFormat, queries, arguments.batchSize))
+        process.start()
+        results.append(resultQueue.get())
+        process.join()
+        print(json.dumps(results[-1], ensure_ascii=False), file=sys.stderr)
+
+    return results
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Нагрузочный тест рекомендательной системы на синтетических каталогах.")
+    parser.add_argument("--sizes", type=int, nargs="+", default=[10000, 100000])
+    parser.add_argument("--queries", type=int, default=1000)
+    parser.add_argument("--batchSize", type=int, default=1)
+    parser.add_argument("--formats", nargs="+", choices=["json", "binary"], default=["json", "binary"])
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--output", default=None)
+    arguments = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as workDirectory:
+        report = {
+            "python": sys.version.split()[0],
+            "results": [result for bookCount in arguments.sizes
+                        for result in benchmarkCatalogSize(bookCount, arguments, workDirectory)]
+        }
+
+    if arguments.output:
+        with open(arguments.output, "w", encoding="utf-8") as file:
+            json.dump(report, file, ensure_ascii=False, indent=4)
+    else:
+        print(json.dumps(report, ensure_ascii=False, indent=4))
@@ -0,0 +1,74 @@
+import math
+from array import array
+from collections import Counter
+
+class Bm25Ranker:
+    def __init__(self, bookIndex, k1=1.2, b=0.75):
+        self.bookIndex = bookIndex
+        self.k1 = k1
+        self.b = b
+
+        self.postings = {}
+        self.documentFrequencies = Counter()
+        self.documentLengths = array("I")
+        self.documentCount = 0
+        self.totalLength = 0
+        self.removedIds = set()
+
+        self.sync()
+
+    def bookTerms(self, bookId):
+        book = self.bookIndex.books[bookId]
+        return Counter(self.bookIndex.tokenize(book["title"].lower() + " " + self.bookIndex.lowerDescriptions[bookId]))
+
+    def sync(self):
+        bookIndex = self.bookIndex
+
+        for bookId in range(len(self.documentLengths), len(bookIndex.books)):
+            terms = self.bookTerms(bookId)
+            for term, frequency in terms.items():
+                posting = self.postings.get(term)
+                if posting is None:
+                    posting = self.postings[term] = (array("I"), array("I"))
+                posting[0].append(bookId)
+                posting[1].append(frequency)
+
+            self.documentFrequencies.update(terms.keys())
+            self.documentLengths.append(sum(terms.values()))
+            self.documentCount += 1
+            self.totalLength += self.documentLengths[-1]
+
+        # Удалённые книги остаются в списках вхождений, но перестают учитываться в статистике.
+        if len(self.removedIds) != len(bookIndex.removedIds):
+            for bookId in bookIndex.removedIds - self.removedIds:
+                self.documentFrequencies.subtract(self.bookTerms(bookId).keys())
+                self.documentCount -= 1
+                self.totalLength -= self.documentLengths[bookId]
+            self.removedIds = set(bookIndex.removedIds)
+
+    def calculateScores(self, keywords):
+        self.sync()
+
+        if not self.documentCount:
+            return {}
+
+        queryTerms = Counter(term for keyword in keywords for term in self.bookIndex.tokenize(keyword))
+        averageLength = self.totalLength / self.documentCount
+        scores = {}
+
+        for term, queryFrequency in queryTerms.items():
+            posting = self.postings.get(term)
+            if posting is None:
+                continue
+
+            documentFrequency = self.documentFrequencies[term]
+            idf = math.log(1 + (self.documentCount - documentFrequency + 0.5) / (documentFrequency + 0.5))
+
+            for bookId, frequency in zip(*posting):
+                if bookId in self.removedIds:
+                    continue
+                lengthNorm = 1 - self.b + self.b * self.documentLengths[bookId] / averageLength
+                weight = idf * frequency * (self.k1 + 1) / (frequency + self.k1 * lengthNorm)
+                scores[bookId] = scores.get(bookId, 0) + queryFrequency * weight
+
+        return scores
@@ -0,0 +1,208 @@
+import numpy
+from scipy import sparse
+
+
+def postingsMatrix(postings, bookCount):
+    rows = []
+    columns = []
+
+    for row, bookIds in enumerate(postings):
+        rows.extend([row] * len(bookIds))
+        columns.extend(bookIds)
+
+    data = numpy.ones(len(rows), dtype=numpy.int32)
+    # Повторы (один автор дважды в списке книги) суммируются при переводе в CSR.
+    return sparse.csr_matrix((data, (rows, columns)), shape=(len(postings), bookCount), dtype=numpy.int32)
+
+
+class VectorScorer:
+    def __init__(self, bookIndex):
+        self.bookIndex = bookIndex
+        self.build()
+
+    def build(self):
+        bookIndex = self.bookIndex
+        self.generation = bookIndex.generation
+        self.bookCount = len(bookIndex.books)
+
+        self.genreColumns = {genre: column for column, genre in enumerate(bookIndex.genreIndex)}
+        self.authorColumns = {author: column for column, author in enumerate(bookIndex.authorIndex)}
+        self.tokenColumns = {token: column for column, token in enumerate(bookIndex.tokenIndex)}
+        self.vocabulary = numpy.array(list(bookIndex.tokenIndex), dtype=str)
+        self.years = numpy.asarray(bookIndex.years, dtype=numpy.int64)
+        self.removedMask = numpy.zeros(self.bookCount, dtype=bool)
+        self.removedMask[list(bookIndex.removedIds)] = True
+
+        self.genreMatrix = postingsMatrix(bookIndex.genreIndex.values(), self.bookCount)
+        self.authorMatrix = postingsMatrix(bookIndex.authorIndex.values(), self.bookCount)
+        self.tokenMatrix = postingsMatrix(bookIndex.tokenIndex.values(), self.bookCount)
+
+    def ingest(self, records):
+        firstBookId = len(self.bookIndex.books)
+
+        # Даже если поток обновлений оборвался на ошибке, уже добавленные книги попадают в матрицы.
+        try:
+            return self.bookIndex.ingest(records)
+        finally:
+            # После уплотнения id книг сменились, и матрицы строятся заново, а не дополняются.
+            if self.generation != self.bookIndex.generation:
+                self.build()
+            else:
+                self.addBooks(range(firstBookId, len(self.bookIndex.books)))
+
+    def addBooks(self, addedIds):
+        bookIndex = self.bookIndex
+
+        genreEntries = []
+        authorEntries = []
+        tokenEntries = []
+        for bookId in addedIds:
+            book = bookIndex.books[bookId]
+            genreEntries.append((self.genreColumns.setdefault(book["genre"].lower(), len(self.genreColumns)), bookId))
+
+            for author in book["author"]:
+                authorEntries.append((self.authorColumns.setdefault(author.lower(), len(self.authorColumns)), bookId))
+
+            for token in set(bookIndex.tokenize(bookIndex.lowerDescriptions[bookId])):
+                tokenEntries.append((self.tokenColumns.setdefault(token, len(self.tokenColumns)), bookId))
+
+        self.bookCount = len(bookIndex.books)
+        self.genreMatrix = self.extendMatrix(self.genreMatrix, len(self.genreColumns), genreEntries)
+        self.authorMatrix = self.extendMatrix(self.authorMatrix, len(self.authorColumns), authorEntries)
+        self.tokenMatrix = self.extendMatrix(self.tokenMatrix, len(self.tokenColumns), tokenEntries)
+
+        self.vocabulary = numpy.append(self.vocabulary, list(self.tokenColumns)[len(self.vocabulary):])
+        self.years = numpy.asarray(bookIndex.years, dtype=numpy.int64)
+        self.removedMask = numpy.zeros(self.bookCount, dtype=bool)
+        self.removedMask[list(bookIndex.removedIds)] = True
+
+    def extendMatrix(self, matrix, featureCount, entries):
+        matrix.resize((featureCount, self.bookCount))
+        rows = [row for row, _ in entries]
+        columns = [bookId for _, bookId in entries]
+        delta = sparse.csr_matrix((numpy.ones(len(entries), dtype=numpy.int32), (rows, columns)),
+                                  shape=(featureCount, self.bookCount))
+        return matrix + delta
+
+    def matchingTokenColumns(self, keywordToken):
+        if not len(self.vocabulary):
+            return numpy.empty(0, dtype=numpy.int64)
+        return numpy.flatnonzero(numpy.char.find(self.vocabulary, keywordToken) >= 0)
+
+    def keywordMatrix(self, keywords):
+        descriptions = self.bookIndex.lowerDescriptions
+
+        partColumns = {}
+        selectorRows = []
+        selectorColumns = []
+        for keyword in keywords:
+            for keywordToken in self.bookIndex.tokenize(keyword):
+                if keywordToken not in partColumns:
+                    tokenColumns = self.matchingTokenColumns(keywordToken)
+                    selectorRows.extend(tokenColumns.tolist())
+                    selectorColumns.extend([len(partColumns)] * len(tokenColumns))
+                    partColumns[keywordToken] = len(partColumns)
+
+        selector = sparse.csr_matrix((numpy.ones(len(selectorColumns), dtype=numpy.int32), (selectorColumns, selectorRows)),
+                                     shape=(len(partColumns), len(self.vocabulary)))
+        partMatches = selector @ self.tokenMatrix
+
+        rows = []
+        columns = []
+        for column, keyword in enumerate(keywords):
+            keywordTokens = self.bookIndex.tokenize(keyword)
+
+            if not keywordTokens:
+                bookIds = [bookId for bookId, description in enumerate(descriptions) if keyword in description]
+            else:
+                bookIds = None
+                for keywordToken in keywordTokens:
+                    partRow = partMatches[partColumns[keywordToken]]
+                    partBookIds = numpy.sort(partRow.indices[partRow.data > 0])
+                    bookIds = partBookIds if bookIds is None else numpy.intersect1d(bookIds, partBookIds, assume_unique=True)
+
+                bookIds = bookIds.tolist()
+                if keywordTokens != [keyword]:
+                    bookIds = [bookId for bookId in bookIds if keyword in descriptions[bookId]]
+
+            rows.extend(bookIds)
+            columns.extend([column] * len(bookIds))
+
+        return sparse.csr_matrix((numpy.ones(len(rows), dtype=numpy.int32), (columns, rows)),
+                                 shape=(len(keywords), self.bookCount), dtype=numpy.int32)
+
+    def scoreMatrix(self, profiles):
+        genreRows, genreColumns = [], []
+        authorRows, authorColumns = [], []
+        keywordColumns = {}
+        keywordRows, keywordProfiles = [], []
+
+        for profile, (genres, authors, keywords) in enumerate(profiles):
+            for genre in set(genres):
+                if genre in self.genreColumns:
+                    genreRows.append(self.genreColumns[genre])
+                    genreColumns.append(profile)
+
+            for author in set(authors):
+                if author in self.authorColumns:
+                    authorRows.append(self.authorColumns[author])
+                    authorColumns.append(profile)
+
+            for keyword in keywords:
+                keywordRows.append(keywordColumns.setdefault(keyword, len(keywordColumns)))
+                keywordProfiles.append(profile)
+
+        profileCount = len(profiles)
+
+        # Запросы умножаются на матрицы «признак × книга», поэтому затрагиваются
+        # только строки выбранных жанров, авторов и токенов, а не весь каталог.
+        genreQuery = sparse.csr_matrix((numpy.full(len(genreRows), 3, dtype=numpy.int32), (genreColumns, genreRows)),
+                                       shape=(profileCount, len(self.genreColumns)))
+        authorQuery = sparse.csr_matrix((numpy.full(len(authorRows), 2, dtype=numpy.int32), (authorColumns, authorRows)),
+                                        shape=(profileCount, len(self.authorColumns)))
+        keywordQuery = sparse.csr_matrix((numpy.ones(len(keywordRows), dtype=numpy.int32), (keywordProfiles, keywordRows)),
+                                         shape=(profileCount, len(keywordColumns)))
+
+        scores = genreQuery @ self.genreMatrix + authorQuery @ self.authorMatrix
+        if keywordColumns:
+            scores = scores + keywordQuery @ self.keywordMatrix(list(keywordColumns))
+
+        scores = sparse.csr_matrix(scores)
+        scores.data[self.removedMask[scores.indices]] = 0
+        scores.eliminate_zeros()
+        return scores
+
+    def scoreProfiles(self, profiles):
+        return self.scoreMatrix(profiles).toarray()
+
+    def calculateScores(self, genres, authors, keywords):
+        return self.calculateScoresBatch([(genres, authors, keywords)])[0]
+
+    def calculateScoresBatch(self, profiles):
+        scores = self.scoreMatrix(profiles)
+        return [dict(zip(row.indices.tolist(), row.data.tolist())) for row in scores]
+
+    def recommendForProfiles(self, profiles, limit, yearFilter=None):
+        scores = self.scoreMatrix(profiles)
+
+        recommendations = []
+        for profile in range(scores.shape[0]):
+            row = scores[profile]
+            candidates = row.indices
+            candidateScores = row.data
+
+            if yearFilter:
+                visible = self.years[candidates] >= yearFilter
+                candidates = candidates[visible]
+                candidateScores = candidateScores[visible]
+
+            if limit < len(candidates):
+                threshold = numpy.partition(candidateScores, -limit)[-limit]
+                visible = candidateScores >= threshold
+                candidates = candidates[visible]
+                candidateScores = candidateScores[visible]
+
+            order = numpy.lexsort((candidates, -candidateScores))[:limit]
+            recommendations.append(list(zip(candidates[order].tolist(), candidateScores[order].tolist())))
+
+        return recommendations
@@ -0,0 +1,55 @@
+import argparse
+import json
+import os
+import signal
+import sys
+import threading
+
+from multiprocessingSpaseImage import processAllImages, watchImages
+
+def printProgress(kind, value):
+    if kind == "message":
+        print(value, file=sys.stderr)
+    elif kind == "progress" and sys.stderr.isatty():
+        eta = f"{value['etaSeconds']:.0f} s" if value["etaSeconds"] is not None else "?"
+        print(f"\r{value['fraction'] * 100:5.1f}%  {value['imagesDone']}/{value['imageCount']} images  "
+              f"{value['tilesPerSecond']:.1f} tiles/s  {value['megabytesPerSecond']:.1f} MB/s  ETA {eta}   ",
+              end="", file=sys.stderr, flush=True)
+    elif kind == "profile":
+        print(json.dumps(value, indent=4), file=sys.stderr)
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Headless astronomical object analyzer for batch and cron runs.")
+    parser.add_argument("inputDirectory")
+    parser.add_argument("outputDirectory")
+    parser.add_argument("--output", default=None, help="result file: .csv, .npz or .parquet")
+    parser.add_argument("--processes", type=int, default=None)
+    parser.add_argument("--partSize", type=int, default=500)
+    parser.add_argument("--overlap", type=int, default=64)
+    parser.add_argument("--measurement", choices=["contours", "components"], default="contours")
+    parser.add_argument("--noAnnotate", action="store_true", help="skip annotated part PNGs")
+    parser.add_argument("--noCache", action="store_true")
+    parser.add_argument("--profile", action="store_true", help="print per-stage timings after the run")
+    parser.add_argument("--watch", action="store_true", help="keep polling the input directory for new images")
+    parser.add_argument("--pollInterval", type=float, default=5.0)
+    arguments = parser.parse_args()
+
+    outputPath = arguments.output or os.path.join(arguments.outputDirectory, "astroObjectsStatistics.csv")
+    analysisOptions = {"partSize": arguments.partSize, "overlap": arguments.overlap,
+                       "measurement": arguments.measurement, "annotate": not arguments.noAnnotate}
+
+    # SIGINT и SIGTERM не обрывают прогон, а просят его остановиться и дописать уже готовые результаты.
+    cancelEvent = threading.Event()
+    for signalNumber in (signal.SIGINT, signal.SIGTERM):
+        signal.signal(signalNumber, lambda *_: cancelEvent.set())
+
+    if arguments.watch:
+        watchImages(arguments.inputDirectory, arguments.outputDirectory, outputPath, printProgress, arguments.processes,
+                    not arguments.noCache, arguments.pollInterval, cancelEvent, **analysisOptions)
+    else:
+        processAllImages(arguments.inputDirectory, arguments.outputDirectory, outputPath, printProgress, arguments.processes,
+                         not arguments.noCache, cancelEvent, arguments.profile, **analysisOptions)
+        if sys.stderr.isatty():
+            print(file=sys.stderr)
+
+    sys.exit(1 if cancelEvent.is_set() and not arguments.watch else 0)
@@ -0,0 +1,120 @@
+import argparse
+import cv2
+import itertools
+import json
+import numpy
+import os
+import sys
+import tempfile
+
+from multiprocessingSpaseImage import processAllImages
+
+dispatchExtensions = {"shared": ".png", "memmap": ".npy"}
+
+def generateStarField(width, height, starsPerMegapixel=2000, galaxyCount=20, seed=0):
+    randomGenerator = numpy.random.default_rng(seed)
+    image = randomGenerator.normal(12, 4, (height, width)).astype(numpy.float32)
+
+    # Звёзды разного размера рисуются точками и размываются группами по ширине профиля.
+    starCount = int(starsPerMegapixel * width * height / 1e6)
+    for sigma in (0.8, 1.4, 2.5):
+        stars = numpy.zeros((height, width), dtype=numpy.float32)
+        count = starCount // 3
+        stars[randomGenerator.integers(0, height, count), randomGenerator.integers(0, width, count)] = \
+            randomGenerator.uniform(400, 4000, count) * sigma ** 2
+        image += cv2.GaussianBlur(stars, (0, 0), sigma)
+
+    for _ in range(galaxyCount):
+        galaxy = numpy.zeros((height, width), dtype=numpy.float32)
+        center = (int(randomGenerator.integers(0, width)), int(randomGenerator.integers(0, height)))
+        axes = (int(randomGenerator.integers(20, 120)), int(randomGenerator.integers(10, 60)))
+        cv2.ellipse(galaxy, center, axes, float(randomGenerator.uniform(0, 180)), 0, 360,
+                    float(randomGenerator.uniform(120, 220)), -1)
+        image += cv2.GaussianBlur(galaxy, (0, 0), max(axes) / 4)
+
+    return cv2.cvtColor(numpy.clip(image, 0, 255).astype(numpy.uint8), cv2.COLOR_GRAY2BGR)
+
+def writeImages(arguments, workDirectory):
+    inputDirectories = {}
+    for dispatch in arguments.dispatch:
+        inputDirectories[dispatch] = os.path.join(workDirectory, f"input_{dispatch}")
+        os.makedirs(inputDirectories[dispatch])
+
+    for imageIndex in range(arguments.images):
+        image = generateStarField(arguments.width, arguments.height, arguments.density, arguments.galaxies,
+                                  arguments.seed + imageIndex)
+        for dispatch, inputDirectory in inputDirectories.items():
+            imagePath = os.path.join(inputDirectory, f"field{imageIndex}{dispatchExtensions[dispatch]}")
+            if dispatch == "memmap":
+                numpy.save(imagePath, image)
+            else:
+                cv2.imwrite(imagePath, image)
+
+    return inputDirectories
+
+def runConfiguration(inputDirectory, outputDirectory, arguments, dispatch, partSize, processCount, measurement):
+    runSummary = processAllImages(inputDirectory, outputDirectory, os.path.join(outputDirectory, "objects.csv"),
+                                  report=lambda kind, value: None, processCount=processCount, useCache=False,
+                                  profileStages=arguments.profile, partSize=partSize, overlap=arguments.overlap,
+                                  measurement=measurement, annotate=arguments.annotate)
+
+    return {
+        "dispatch": dispatch,
+        "partSize": partSize,
+        "processes": processCount,
+        "measurement": measurement,
+        "images": runSummary["imagesDone"],
+        "tiles": runSummary["tilesDone"],
+        "objects": runSummary["objects"],
+        "seconds": round(runSummary["seconds"], 4),
+        "imagesPerSecond": round(runSummary["imagesDone"] / runSummary["seconds"], 3),
+        "tilesPerSecond": round(runSummary["tilesPerSecond"], 2),
+        "megabytesPerSecond": round(runSummary["megabytesPerSecond"], 2),
+        "stages": runSummary["stages"]
+    }
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark of the astronomical analyzer on synthetic star fields.")
+    parser.add_argument("--width", type=int, default=4000)
+    parser.add_argument("--height", type=int, default=3000)
+    parser.add_argument("--images", type=int, default=4)
+    parser.add_argument("--density", type=float, default=2000, help="stars per megapixel")
+    parser.add_argument("--galaxies", type=int, default=20)
+    parser.add_argument("--partSizes", type=int, nargs="+", default=[250, 500, 1000])
+    parser.add_argument("--overlap", type=int, default=64)
+    parser.add_argument("--processes", type=int, nargs="+", default=[1, os.cpu_count()])
+    parser.add_argument("--dispatch", choices=sorted(dispatchExtensions), nargs="+", default=["shared", "memmap"])
+    parser.add_argument("--measurement", choices=["contours", "components"], nargs="+", default=["contours"])
+    parser.add_argument("--annotate", action="store_true")
+    parser.add_argument("--profile", action="store_true", help="record per-stage timings")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--output", default=None)
+    arguments = parser.parse_args()
+
+    results = []
+    with tempfile.TemporaryDirectory() as workDirectory:
+        inputDirectories = writeImages(arguments, workDirectory)
+
+        for dispatch, partSize, processCount, measurement in itertools.product(
+                arguments.dispatch, arguments.partSizes, arguments.processes, arguments.measurement):
+            outputDirectory = os.path.join(workDirectory, f"output_{len(results)}")
+            results.append(runConfiguration(inputDirectories[dispatch], outputDirectory, arguments,
+                                            dispatch, partSize, processCount, measurement))
+            print(json.dumps({key: value for key, value in results[-1].items() if key != "stages"}), file=sys.stderr)
+
+    report = {
+        "python": sys.version.split()[0],
+        "opencv": cv2.__version__,
+        "cpuCount": os.cpu_count(),
+        "imageSize": [arguments.width, arguments.height],
+        "images": arguments.images,
+        "starsPerMegapixel": arguments.density,
+        "annotate": arguments.annotate,
+        "results": results
+    }
+
+    if arguments.output:
+        with open(arguments.output, "w", encoding="utf-8") as file:
+            json.dump(report, file, indent=4)
+    else:
+        print(json.dumps(report, indent=4))
@@ -0,0 +1,138 @@
+import cv2
+import numpy
+import os
+from multiprocessing import resource_tracker, shared_memory
+
+fitsExtensions = ('.fits', '.fit', '.fts')
+memmapExtensions = ('.npy',) + fitsExtensions
+fitsBlockSize = 2880
+fitsDtypes = {8: ">u1", 16: ">i2", 32: ">i4", 64: ">i8", -32: ">f4", -64: ">f8"}
+
+def openImageSource(imagePath):
+    extension = os.path.splitext(imagePath)[1].lower()
+
+    if extension not in memmapExtensions:
+        image = cv2.imread(imagePath)
+        if image is None:
+            return None, None
+
+        # Сжатые форматы декодируются целиком, и изображение кладётся в разделяемую память один раз,
+        # а воркеры получают только координаты своей части и читают её без копирования и pickle.
+        sharedImage = shared_memory.SharedMemory(create=True, size=image.nbytes)
+        sharedArray = numpy.ndarray(image.shape, dtype=image.dtype, buffer=sharedImage.buf)
+        sharedArray[:] = image
+        del sharedArray
+
+        source = {"kind": "shared", "name": sharedImage.name, "shape": image.shape,
+                  "dtype": image.dtype.str, "levels": None, "pixelBytes": pixelBytes(image)}
+        return source, sharedImage
+
+    # Несжатые массивы не читаются целиком: воркеры отображают файл в память и берут только свою часть.
+    if extension == ".npy":
+        source = {"kind": "npy", "path": imagePath}
+    else:
+        offset, dtype, fileShape = readFitsHeader(imagePath)
+        source = {"kind": "fits", "path": imagePath, "offset": offset, "dtype": dtype, "fileShape": fileShape}
+
+    image, _ = attachImage(source)
+    if image.ndim not in (2, 3) or (image.ndim == 3 and image.shape[2] not in (1, 3)):
+        raise ValueError(f"Unsupported array shape {image.shape} in {imagePath}")
+
+    source["shape"] = image.shape
+    source["levels"] = intensityLevels(image)
+    source["pixelBytes"] = pixelBytes(image)
+    return source, None
+
+def readFitsHeader(imagePath):
+    header = {}
+    headerSize = 0
+
+    with open(imagePath, "rb") as file:
+        while "END" not in header:
+            block = file.read(fitsBlockSize)
+            if len(block) < fitsBlockSize:
+                raise ValueError(f"Truncated FITS header in {imagePath}")
+            headerSize += fitsBlockSize
+
+            for cardStart in range(0, fitsBlockSize, 80):
+                card = block[cardStart:cardStart + 80].decode("ascii", "replace")
+                keyword = card[:8].strip()
+                if keyword == "END":
+                    header["END"] = True
+                    break
+                if card[8:10] == "= ":
+                    header[keyword] = card[10:].split("/")[0].strip()
+
+    bitsPerPixel = int(header.get("BITPIX", 0))
+    axisCount = int(header.get("NAXIS", 0))
+    if bitsPerPixel not in fitsDtypes or axisCount not in (2, 3):
+        raise ValueError(f"Unsupported FITS image in {imagePath}")
+
+    # В FITS первой идёт самая быстрая ось, а numpy ждёт обратного порядка.
+    fileShape = tuple(int(header[f"NAXIS{axis}"]) for axis in range(axisCount, 0, -1))
+    return headerSize, fitsDtypes[bitsPerPixel], fileShape
+
+def attachImage(source):
+    if source["kind"] == "shared":
+        sharedImage = attachSharedMemory(source["name"])
+        return numpy.ndarray(source["shape"], dtype=source["dtype"], buffer=sharedImage.buf), sharedImage
+
+    if source["kind"] == "npy":
+        return numpy.load(source["path"], mmap_mode="r"), None
+
+    image = numpy.memmap(source["path"], dtype=source["dtype"], mode="r",
+                         offset=source["offset"], shape=source["fileShape"])
+    if image.ndim == 3:
+        # Плоскости куба FITS идут в порядке RGB, а OpenCV работает с BGR.
+        image = numpy.moveaxis(image, 0, -1)[..., ::-1]
+    return image, None
+
+def readImageWindow(image, source, offsetX, offsetY, partWidth, partHeight):
+    window = image[offsetY:offsetY + partHeight, offsetX:offsetX + partWidth]
+
+    if source["levels"] is not None:
+        low, high = source["levels"]
+        window = numpy.nan_to_num((window.astype(numpy.float32) - low) * (255 / (high - low)))
+        window = numpy.clip(window, 0, 255).astype(numpy.uint8)
+
+    if window.ndim == 3 and window.shape[2] == 1:
+        window = window[:, :, 0]
+    if window.ndim == 2:
+        window = cv2.cvtColor(numpy.ascontiguousarray(window), cv2.COLOR_GRAY2BGR)
+
+    return window
+
+def pixelBytes(image):
+    return image.dtype.itemsize * (image.shape[2] if image.ndim == 3 else 1)
+
+def intensityLevels(image, sampleSize=1000000):
+    if image.dtype == numpy.uint8:
+        return None
+
+    # Уровни считаются один раз по прореженной выборке, чтобы все части растягивались одинаково.
+    step = max(int((image.shape[0] * image.shape[1] / sampleSize) ** 0.5), 1)
+    sample = numpy.asarray(image[::step, ::step], dtype=numpy.float64)
+    low, high = numpy.nanpercentile(sample, (0.5, 99.5))
+    if not numpy.isfinite(low) or not numpy.isfinite(high):
+        low, high = 0.0, 1.0
+
+    return float(low), float(high) if high > low else float(low) + 1.0
+
+def attachSharedMemory(sharedName):
+    try:
+        return shared_memory.SharedMemory(name=sharedName, track=False)
+    except TypeError:
+        pass
+
+    # До Python 3.13 подключение к сегменту регистрирует его в resource_tracker воркера,
+    # и тот пытается удалить чужой сегмент при завершении процесса.
+    register = resource_tracker.register
+    resource_tracker.register = lambda name, rtype: None
+    try:
+        return shared_memory.SharedMemory(name=sharedName)
+    finally:
+        resource_tracker.register = register
+
+def releaseSharedImage(sharedImage):
+    sharedImage.close()
+    sharedImage.unlink()
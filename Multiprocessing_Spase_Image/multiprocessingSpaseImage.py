@@ -1,10 +1,20 @@
-import csv
 import cv2
 import multiprocessing
 import numpy
 import os
+import queue
+import signal
+import threading
+import time
 import tkinter as tk
-from tkinter import filedialog, messagebox, Text
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from tkinter import filedialog, messagebox, ttk, Text
+
+from imageSources import attachImage, memmapExtensions, openImageSource, readImageWindow, releaseSharedImage
+from resultCache import ResultCache
+from resultWriters import openResultWriter
+from stageProfiling import StageProfile, enableProfiling, finishTile, isTimingTile, startTile, timedStage
 
 objectColors = {
     "Star": (255, 0, 0),
@@ -13,14 +23,85 @@ objectColors = {
     "Unknown Object": (255, 255, 0)
 }
 
+imageExtensions = ('.png', '.jpg', '.jpeg', '.bmp', '.tiff') + memmapExtensions
+claheClipLimit = 2.0
+claheTileGridSize = (8, 8)
+blurKernelSize = (5, 5)
+binaryThreshold = 140
+
+imageWriter = None
+writeSlots = None
+
+def initWorker(pendingWrites, profileStages=False):
+    global imageWriter, writeSlots
+
+    # Отмену обрабатывает главный процесс, а воркеры завершаются по terminate() обычным образом.
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    signal.signal(signal.SIGTERM, signal.SIG_DFL)
+    imageWriter = ThreadPoolExecutor(max_workers=1)
+    writeSlots = threading.BoundedSemaphore(pendingWrites)
+    if profileStages:
+        enableProfiling()
+
 def analyzeImagePart(arguments):
-    imagePart, partIndex, imageName, offsetX, offsetY, outputDirectory = arguments
-    
-    grayImage = applyCLAHE(imagePart) 
-    blurredImage = cv2.GaussianBlur(grayImage, (5, 5), 0)
-    _, binaryImage = cv2.threshold(blurredImage, 140, 255, cv2.THRESH_BINARY)
-    contours, _ = cv2.findContours(binaryImage, cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE)
-    
+    imageSource, partIndex, imageName, offsetX, offsetY, partWidth, partHeight, outputDirectory, measurement, annotate = arguments
+
+    startTile()
+    with timedStage("read"):
+        image, sharedImage = attachImage(imageSource)
+    try:
+        with timedStage("read"):
+            imagePart = readImageWindow(image, imageSource, offsetX, offsetY, partWidth, partHeight)
+        objectsData = analyzeTile(imagePart, partIndex, imageName, offsetX, offsetY, outputDirectory, measurement, annotate)
+        return objectsData, finishTile()
+    finally:
+        # Пока на буфер ссылаются массивы, сегмент нельзя закрыть.
+        image = imagePart = None
+        if sharedImage is not None:
+            sharedImage.close()
+
+def analyzeTile(imagePart, partIndex, imageName, offsetX, offsetY, outputDirectory, measurement="contours", annotate=True):
+    objectsData = detectObjects(imagePart, partIndex, imageName, offsetX, offsetY, measurement)
+    if not annotate:
+        return objectsData
+
+    # Части с ореолами пересекаются, поэтому рамки рисуются на копии, а общая память остаётся только для чтения.
+    with timedStage("annotate"):
+        imagePart = imagePart.copy()
+        for objectData in objectsData:
+            x, y, contourWidth, contourHeight = objectData["boundingBox"]
+            x -= offsetX
+            y -= offsetY
+
+            color = objectColors.get(objectData["type"], (0, 255, 255))
+            cv2.rectangle(imagePart, (x, y), (x + contourWidth, y + contourHeight), color, 2)
+            cv2.putText(imagePart, objectData["type"], (x, y - 10), cv2.FONT_HERSHEY_SIMPLEX, 0.5, color, 1)
+
+    partImagePath = os.path.join(outputDirectory, f"{imageName}_part{partIndex}.png")
+    writeImage(partImagePath, imagePart)
+
+    #print(f"Finished analyzing part {partIndex} of image {imageName}")
+    return objectsData
+
+def detectObjects(imagePart, partIndex, imageName, offsetX, offsetY, measurement="contours"):
+    with timedStage("clahe"):
+        grayImage = applyCLAHE(imagePart) 
+    with timedStage("blur"):
+        blurredImage = cv2.GaussianBlur(grayImage, blurKernelSize, 0)
+    with timedStage("threshold"):
+        _, binaryImage = cv2.threshold(blurredImage, binaryThreshold, 255, cv2.THRESH_BINARY)
+
+    if measurement == "components":
+        with timedStage("components"):
+            return measureComponents(binaryImage, grayImage, partIndex, imageName, offsetX, offsetY)
+
+    with timedStage("findContours"):
+        contours, _ = cv2.findContours(binaryImage, cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE)
+
+    with timedStage("measure"):
+        return measureContours(contours, grayImage, partIndex, imageName, offsetX, offsetY)
+
+def measureContours(contours, grayImage, partIndex, imageName, offsetX, offsetY):
     objectsData = []
     
     for contour in contours:
@@ -32,10 +113,6 @@ def analyzeImagePart(arguments):
         brightness = numpy.sum(grayImage[y:y + contourHeight, x:x + contourWidth])
         objectType = classifyObject(contourArea, brightness)
 
-        color = objectColors.get(objectType, (0, 255, 255))
-        cv2.rectangle(imagePart, (x, y), (x + contourWidth, y + contourHeight), color, 2)
-        cv2.putText(imagePart, objectType, (x, y - 10), cv2.FONT_HERSHEY_SIMPLEX, 0.5, color, 1)
-        
         objectsData.append({
             "imageName": imageName,
             "partIndex": partIndex,
@@ -43,18 +120,61 @@ def analyzeImagePart(arguments):
             "brightness": brightness,
             "area": contourArea,
             "type": objectType,
-            "size": contourWidth * contourHeight
+            "size": contourWidth * contourHeight,
+            "boundingBox": (x + offsetX, y + offsetY, contourWidth, contourHeight)
         })
 
-    partImagePath = os.path.join(outputDirectory, f"{imageName}_part{partIndex}.png")
-    cv2.imwrite(partImagePath, imagePart)
-
-    #print(f"Finished analyzing part {partIndex} of image {imageName}")
     return objectsData
 
+def measureComponents(binaryImage, grayImage, partIndex, imageName, offsetX, offsetY):
+    # Все объекты части измеряются разом: площадь и рамка берутся из статистики компонент,
+    # а яркость суммируется только по пикселям самого объекта, а не по всей рамке.
+    componentCount, labels, stats, centroids = cv2.connectedComponentsWithStats(binaryImage, connectivity=8)
+    labels = labels.ravel()
+    foreground = labels > 0
+    brightness = numpy.bincount(labels[foreground], weights=grayImage.ravel()[foreground], minlength=componentCount)[1:]
+    brightness = brightness.astype(numpy.int64)
+
+    stats = stats[1:]
+    areas = stats[:, cv2.CC_STAT_AREA]
+    objectTypes = classifyObjects(areas, brightness)
+
+    lefts = stats[:, cv2.CC_STAT_LEFT] + offsetX
+    tops = stats[:, cv2.CC_STAT_TOP] + offsetY
+    widths = stats[:, cv2.CC_STAT_WIDTH]
+    heights = stats[:, cv2.CC_STAT_HEIGHT]
+    centersX = numpy.rint(centroids[1:, 0]).astype(numpy.int64) + offsetX
+    centersY = numpy.rint(centroids[1:, 1]).astype(numpy.int64) + offsetY
+
+    return [{
+        "imageName": imageName,
+        "partIndex": partIndex,
+        "coordinates": (centerX, centerY),
+        "brightness": objectBrightness,
+        "area": area,
+        "type": objectType,
+        "size": width * height,
+        "boundingBox": (left, top, width, height)
+    } for centerX, centerY, objectBrightness, area, objectType, left, top, width, height in zip(
+        centersX.tolist(), centersY.tolist(), brightness.tolist(), areas.tolist(), objectTypes.tolist(),
+        lefts.tolist(), tops.tolist(), widths.tolist(), heights.tolist())]
+
+def writeImage(imagePath, image):
+    # При замере стадий PNG кодируется синхронно, иначе его время не попало бы в отчёт о части.
+    if imageWriter is None or isTimingTile():
+        with timedStage("pngEncode"):
+            cv2.imwrite(imagePath, image)
+        return
+
+    # Запись идёт в фоне: часть кодируется отдельным потоком,
+    # а в очереди каждого воркера ждут не больше pendingWrites частей.
+    writeSlots.acquire()
+    future = imageWriter.submit(cv2.imwrite, imagePath, image)
+    future.add_done_callback(lambda _: writeSlots.release())
+
 def applyCLAHE(image):
     grayImage = cv2.cvtColor(image, cv2.COLOR_BGR2GRAY)
-    clahe = cv2.createCLAHE(clipLimit=2.0, tileGridSize=(8, 8))
+    clahe = cv2.createCLAHE(clipLimit=claheClipLimit, tileGridSize=claheTileGridSize)
     equalizedImage = clahe.apply(grayImage)
     
     return equalizedImage
@@ -69,57 +189,502 @@ def classifyObject(area, brightness):
     else:
         return "Unknown Object"
 
-def processAllImages(inputDirectory, outputDirectory, outputCSVPath, statusText):
-    allResults = []
+def classifyObjects(areas, brightness):
+    # Векторный вариант classifyObject: условия проверяются в том же порядке, побеждает первое выполненное.
+    return numpy.select([(areas < 100) & (brightness > 700),
+                         (areas < 1000) & (brightness > 300),
+                         (areas >= 1000) & (brightness > 10000)],
+                        ["Star", "Planet", "Galaxy"], "Unknown Object")
+
+def analysisParameters(partSize, overlap, measurement, annotate):
+    # annotate входит в ключ: результат прогона без разметки не должен избавлять следующий прогон от записи PNG частей.
+    return {
+        "claheClipLimit": claheClipLimit,
+        "claheTileGridSize": claheTileGridSize,
+        "blurKernelSize": blurKernelSize,
+        "binaryThreshold": binaryThreshold,
+        "partSize": partSize,
+        "overlap": overlap,
+        "measurement": measurement,
+        "annotate": annotate
+    }
+
+def listImages(inputDirectory):
+    imagePaths = []
+    for imageName in os.listdir(inputDirectory):
+        imagePath = os.path.join(inputDirectory, imageName)
+        if imagePath.lower().endswith(imageExtensions):
+            imagePaths.append(imagePath)
+    return imagePaths
+
+def printReport(kind, value):
+    if kind == "message":
+        print(value)
+
+class ProgressMeter:
+    # Прогресс считается по долям готовых частей каждого изображения, а скорость — по частям и байтам.
+    def __init__(self, imageCount, report, interval=0.5):
+        self.imageCount = imageCount
+        self.report = report
+        self.interval = interval
+        self.startTime = time.monotonic()
+        self.lastReport = 0.0
+        self.tilesDone = 0
+        self.bytesDone = 0
+        self.imagesDone = 0
+        self.imageFractions = {}
 
+    def tileDone(self, imageName, tileBytes, completedTiles, totalTiles):
+        self.tilesDone += 1
+        self.bytesDone += tileBytes
+        self.imageFractions[imageName] = completedTiles / totalTiles
+
+        if time.monotonic() - self.lastReport >= self.interval:
+            self.report("progress", self.snapshot())
+
+    def imageDone(self, imageName):
+        self.imagesDone += 1
+        self.imageFractions.pop(imageName, None)
+        self.report("progress", self.snapshot())
+
+    def snapshot(self):
+        self.lastReport = time.monotonic()
+        elapsed = max(self.lastReport - self.startTime, 1e-9)
+        fraction = (self.imagesDone + sum(self.imageFractions.values())) / self.imageCount if self.imageCount else 1.0
+
+        return {
+            "imagesDone": self.imagesDone,
+            "imageCount": self.imageCount,
+            "tilesDone": self.tilesDone,
+            "fraction": fraction,
+            "tilesPerSecond": self.tilesDone / elapsed,
+            "megabytesPerSecond": self.bytesDone / elapsed / (1024 * 1024),
+            "etaSeconds": elapsed * (1 - fraction) / fraction if fraction > 0 else None
+        }
+
+def processAllImages(inputDirectory, outputDirectory, outputCSVPath, report=printReport, processCount=None, useCache=True,
+                     cancelEvent=None, profileStages=False, **analysisOptions):
     if not os.path.exists(inputDirectory):
-        statusText.insert(tk.END, "Input directory does not exist!\n")
+        report("message", "Input directory does not exist!")
         return
     if not os.path.exists(outputDirectory):
         os.makedirs(outputDirectory)
 
-    for imageName in os.listdir(inputDirectory):
-        imagePath = os.path.join(inputDirectory, imageName)
-        if imagePath.lower().endswith(('.png', '.jpg', '.jpeg', '.bmp', '.tiff')):
-            statusText.insert(tk.END, f"Processing {imageName}...\n")
-            statusText.update_idletasks()
-            objectsData = processImage(imagePath, outputDirectory)
-            allResults.extend(objectsData)
-
-    with open(outputCSVPath, mode='w', newline='') as csvFile:
-        fieldnames = ['imageName', 'partIndex', 'coordinates', 'brightness', 'area', 'type', 'size']
-        csvWriter = csv.DictWriter(csvFile, fieldnames=fieldnames)
-        csvWriter.writeheader()
-        
-        for objectData in allResults:
-            csvWriter.writerow({
-                'imageName': objectData['imageName'],
-                'partIndex': objectData['partIndex'],
-                'coordinates': objectData['coordinates'],
-                'brightness': objectData['brightness'],
-                'area': objectData['area'],
-                'type': objectData['type'],
-                'size': objectData['size']
-            })
-
-    statusText.insert(tk.END, f"Analysis complete. Results saved to {outputCSVPath}\n")
-
-def processImage(imagePath, outputDirectory):
-    image = cv2.imread(imagePath)
+    imagePaths = listImages(inputDirectory)
+    cacheDirectory = os.path.join(outputDirectory, ".astroCache") if useCache else None
+    progressMeter = ProgressMeter(len(imagePaths), report)
+    stageProfile = StageProfile() if profileStages else None
+    objectCount = 0
+
+    report("message", f"Processing {len(imagePaths)} images...")
+
+    # Результаты пишутся по мере готовности изображений, а формат файла выбирается по расширению.
+    resultWriter = openResultWriter(outputCSVPath)
+    processPool = createPool(processCount, profileStages=profileStages)
+    try:
+        for imageName, objectsData in processImages(imagePaths, outputDirectory, processPool, cacheDirectory=cacheDirectory,
+                                                    onTile=progressMeter.tileDone, cancelEvent=cancelEvent,
+                                                    stageProfile=stageProfile, **analysisOptions):
+            if objectsData is None:
+                report("message", f"Could not read {imageName}, skipped.")
+            else:
+                report("message", f"Processed {imageName}")
+                resultWriter.write(objectsData)
+                objectCount += len(objectsData)
+            progressMeter.imageDone(imageName)
+
+        # close() и join() дают воркерам дописать отложенные PNG, terminate() бы их потерял.
+        if cancelEvent is None or not cancelEvent.is_set():
+            processPool.close()
+            processPool.join()
+    finally:
+        processPool.terminate()
+        resultWriter.close()
+
+    if cancelEvent is not None and cancelEvent.is_set():
+        report("message", f"Analysis cancelled. Partial results saved to {outputCSVPath}")
+    else:
+        report("message", f"Analysis complete. Results saved to {outputCSVPath}")
+
+    runSummary = dict(progressMeter.snapshot(), objects=objectCount,
+                      seconds=time.monotonic() - progressMeter.startTime,
+                      stages=stageProfile.summary() if stageProfile is not None else None)
+    if stageProfile is not None:
+        report("profile", runSummary["stages"])
+    return runSummary
+
+def watchImages(inputDirectory, outputDirectory, outputPath, report=printReport, processCount=None, useCache=True,
+                pollInterval=5.0, stopEvent=None, **analysisOptions):
+    if not os.path.exists(outputDirectory):
+        os.makedirs(outputDirectory)
+    cacheDirectory = os.path.join(outputDirectory, ".astroCache") if useCache else None
+
+    processedPaths = set()
+    fileSizes = {}
+
+    resultWriter = openResultWriter(outputPath)
+    processPool = createPool(processCount)
+    try:
+        while stopEvent is None or not stopEvent.is_set():
+            # Файл берётся в работу, когда его размер не изменился между двумя опросами,
+            # чтобы не читать изображение, которое конвейер телескопа ещё дописывает.
+            readyPaths = []
+            for imagePath in listImages(inputDirectory):
+                if imagePath in processedPaths:
+                    continue
+                fileSize = os.path.getsize(imagePath)
+                if fileSizes.get(imagePath) == fileSize:
+                    readyPaths.append(imagePath)
+                fileSizes[imagePath] = fileSize
+
+            for imageName, objectsData in processImages(readyPaths, outputDirectory, processPool, cacheDirectory=cacheDirectory,
+                                                        cancelEvent=stopEvent, **analysisOptions):
+                if objectsData is None:
+                    report("message", f"Could not read {imageName}, skipped.")
+                else:
+                    report("message", f"Processed {imageName}")
+                    resultWriter.write(objectsData)
+                processedPaths.add(os.path.join(inputDirectory, imageName))
+
+            if readyPaths:
+                resultWriter.flush()
+
+            if stopEvent is None:
+                time.sleep(pollInterval)
+            else:
+                stopEvent.wait(pollInterval)
+
+        processPool.close()
+        processPool.join()
+    finally:
+        processPool.terminate()
+        resultWriter.close()
+
+def createPool(processCount=None, pendingWrites=4, profileStages=False):
+    return multiprocessing.Pool(processes=processCount or os.cpu_count(),
+                                initializer=initWorker, initargs=(pendingWrites, profileStages))
+
+def processImage(imagePath, outputDirectory, processPool=None):
+    if processPool is not None:
+        for _, objectsData in processImages([imagePath], outputDirectory, processPool):
+            return objectsData or []
+
+    processPool = createPool()
+    try:
+        objectsData = processImage(imagePath, outputDirectory, processPool)
+        processPool.close()
+        processPool.join()
+    finally:
+        processPool.terminate()
+
+    return objectsData
+
+def processImages(imagePaths, outputDirectory, processPool, partSize=500, overlap=64, measurement="contours",
+                  annotate=True, cacheDirectory=None, onTile=None, cancelEvent=None, stageProfile=None,
+                  prefetchCount=2, maxImagesInFlight=3):
+    completedParts = queue.Queue()
+    imagesInFlight = {}
+    decodingImages = deque()
+    pathIterator = iter(imagePaths)
+    resultCache = ResultCache(cacheDirectory, analysisParameters(partSize, overlap, measurement, annotate)) if cacheDirectory else None
+
+    def decodeNextImage():
+        imagePath = next(pathIterator, None)
+        if imagePath is not None:
+            decodingImages.append((imagePath, imageDecoder.submit(loadImage, imagePath, resultCache)))
+
+    # Пока пул разбирает части до maxImagesInFlight изображений, следующие prefetchCount
+    # файлов уже декодируются, и воркеры не простаивают между изображениями.
+    with ThreadPoolExecutor(max_workers=prefetchCount) as imageDecoder:
+        for _ in range(prefetchCount):
+            decodeNextImage()
+
+        try:
+            while decodingImages or imagesInFlight:
+                if cancelEvent is not None and cancelEvent.is_set():
+                    return
+
+                # Готовые изображения отдаются в порядке подачи, чтобы CSV не зависел от расписания пула.
+                while imagesInFlight:
+                    imagePath, imageState = next(iter(imagesInFlight.items()))
+                    if "objectsData" not in imageState:
+                        break
+                    del imagesInFlight[imagePath]
+                    yield os.path.basename(imagePath), imageState["objectsData"]
+
+                if decodingImages and len(imagesInFlight) < maxImagesInFlight:
+                    imagePath, decodedImage = decodingImages.popleft()
+                    decodeNextImage()
+
+                    try:
+                        cacheKey, cachedObjects, imageSource, sharedImage = decodedImage.result()
+                    except (OSError, ValueError):
+                        cacheKey, cachedObjects, imageSource = None, None, None
+
+                    if cachedObjects is not None:
+                        imagesInFlight[imagePath] = {"objectsData": cachedObjects}
+                    elif imageSource is None:
+                        yield os.path.basename(imagePath), None
+                    else:
+                        imagesInFlight[imagePath] = submitImage(imageSource, sharedImage, imagePath, outputDirectory,
+                                                                processPool, partSize, overlap, measurement, annotate,
+                                                                completedParts)
+                        imagesInFlight[imagePath]["cacheKey"] = cacheKey
+                    continue
+
+                if not imagesInFlight:
+                    continue
+
+                # Ожидание с таймаутом, чтобы отмена срабатывала, даже пока воркеры заняты.
+                try:
+                    imagePath, partIndex, partResult, completedAt = completedParts.get(timeout=0.2)
+                except queue.Empty:
+                    continue
+                if isinstance(partResult, BaseException):
+                    raise partResult
+
+                imageState = imagesInFlight[imagePath]
+                imageState["results"][partIndex], tileTimings = partResult
+                if stageProfile is not None and tileTimings is not None:
+                    stageProfile.add(tileTimings, completedAt - imageState["submittedAt"])
+                if onTile is not None:
+                    _, _, partWidth, partHeight, _, _ = imageState["imageParts"][partIndex]
+                    onTile(imageState["imageName"], partWidth * partHeight * imageState["imageSource"]["pixelBytes"],
+                           len(imageState["results"]), len(imageState["imageParts"]))
+                if len(imageState["results"]) == len(imageState["imageParts"]):
+                    imageState["objectsData"] = mergeImageObjects(imageState, partSize)
+                    releaseImageState(imageState)
+                    if resultCache is not None:
+                        resultCache.put(imageState["cacheKey"], imageState["objectsData"])
+        finally:
+            for imageState in imagesInFlight.values():
+                if "sharedImage" in imageState:
+                    releaseImageState(imageState)
+            # Уже открытые заранее изображения тоже держат разделяемую память.
+            for _, decodedImage in decodingImages:
+                try:
+                    _, _, _, sharedImage = decodedImage.result()
+                except (OSError, ValueError):
+                    continue
+                if sharedImage is not None:
+                    releaseSharedImage(sharedImage)
+            if resultCache is not None:
+                resultCache.save()
+
+def loadImage(imagePath, resultCache):
+    cacheKey = None
+    if resultCache is not None:
+        cacheKey = resultCache.key(imagePath)
+        cachedObjects = resultCache.get(cacheKey, os.path.basename(imagePath))
+        if cachedObjects is not None:
+            return cacheKey, cachedObjects, None, None
+
+    imageSource, sharedImage = openImageSource(imagePath)
+    return cacheKey, None, imageSource, sharedImage
+
+def submitImage(imageSource, sharedImage, imagePath, outputDirectory, processPool, partSize, overlap, measurement,
+                annotate, completedParts):
     imageName = os.path.basename(imagePath)
-    
-    imageParts = splitImage(image, 500)
-    arguments = [(part, partIndex, imageName, offsetX, offsetY, outputDirectory) 
-                 for part, offsetX, offsetY, partIndex in imageParts]
-    
-    with multiprocessing.Pool(processes=16) as processPool:
-        results = processPool.map(analyzeImagePart, arguments)
 
-    allObjectsData = []
-    for objectData in results:
-        allObjectsData.extend(objectData)
+    imageParts = splitImage(imageSource["shape"], partSize, overlap)
+    submittedAt = time.perf_counter()
+    for offsetX, offsetY, partWidth, partHeight, partIndex, _ in imageParts:
+        arguments = (imageSource, partIndex, imageName,
+                     offsetX, offsetY, partWidth, partHeight, outputDirectory, measurement, annotate)
+        processPool.apply_async(
+            analyzeImagePart, (arguments,),
+            callback=lambda partResult, partIndex=partIndex: completedParts.put(
+                (imagePath, partIndex, partResult, time.perf_counter())),
+            error_callback=lambda error: completedParts.put((imagePath, None, error, None)))
+
+    return {"imageSource": imageSource, "sharedImage": sharedImage, "imageName": imageName,
+            "imageParts": imageParts, "measurement": measurement, "submittedAt": submittedAt, "results": {}}
+
+def releaseImageState(imageState):
+    if imageState["sharedImage"] is not None:
+        releaseSharedImage(imageState["sharedImage"])
+        imageState["sharedImage"] = None
+
+def mergeImageObjects(imageState, gridSize):
+    imageHeight, imageWidth = imageState["imageSource"]["shape"][:2]
+    imageParts = {imagePart[4]: imagePart for imagePart in imageState["imageParts"]}
+
+    completeObjects = []
+    fragments = []
+    for partIndex in sorted(imageState["results"]):
+        offsetX, offsetY, partWidth, partHeight, _, (coreX, coreY, coreWidth, coreHeight) = imageParts[partIndex]
+        for objectData in imageState["results"][partIndex]:
+            x, y, contourWidth, contourHeight = objectData["boundingBox"]
+            # Объект обрезан, если касается края части, который не совпадает с краем изображения.
+            truncated = ((x == offsetX and offsetX > 0) or
+                         (y == offsetY and offsetY > 0) or
+                         (x + contourWidth == offsetX + partWidth and offsetX + partWidth < imageWidth) or
+                         (y + contourHeight == offsetY + partHeight and offsetY + partHeight < imageHeight))
+            if truncated:
+                fragments.append(objectData)
+                continue
+
+            centerX, centerY = objectData["coordinates"]
+            inCore = coreX <= centerX < coreX + coreWidth and coreY <= centerY < coreY + coreHeight
+            completeObjects.append((not inCore, objectData))
+
+    # Полный объект, найденный целиком в нескольких частях, — это одни и те же пиксели.
+    # Первыми берутся обнаружения из ядра своей части, так что из копий в ореолах соседей остаётся копия владельца,
+    # а соседние объекты, чьи рамки лишь касаются, остаются разными. Копии сравниваются и по перекрытию рамок:
+    # в плотном поле одна часть после своего выравнивания контраста видит две звезды, а соседняя — одно пятно.
+    completeObjects.sort(key=lambda entry: entry[0])
+    objectsData = []
+    keptObjects = {}
+    for _, objectData in completeObjects:
+        box = objectData["boundingBox"]
+        if not any(otherData["partIndex"] != objectData["partIndex"] and duplicateObject(box, otherData["boundingBox"])
+                   for otherData in nearbyObjects(keptObjects, box, gridSize)):
+            addToGrid(keptObjects, objectData, gridSize)
+            objectsData.append(objectData)
 
-    return allObjectsData
+    # Обрезанный кусок объекта, который целиком нашёлся в другой части, лежит внутри его рамки и отбрасывается.
+    fragments = [objectData for objectData in fragments
+                 if not any(otherData["partIndex"] != objectData["partIndex"] and boxInside(objectData["boundingBox"], otherData["boundingBox"])
+                            for otherData in nearbyObjects(keptObjects, objectData["boundingBox"], gridSize))]
+
+    # Остаются объекты больше ореола, обрезанные во всех частях: их куски из разных частей перекрываются
+    # в ореолах через границу ядер и собираются в группы.
+    parents = list(range(len(fragments)))
+
+    def findRoot(fragmentId):
+        while parents[fragmentId] != fragmentId:
+            parents[fragmentId] = parents[parents[fragmentId]]
+            fragmentId = parents[fragmentId]
+        return fragmentId
+
+    fragmentGrid = {}
+    for fragmentId, objectData in enumerate(fragments):
+        for otherId in nearbyObjects(fragmentGrid, objectData["boundingBox"], gridSize):
+            otherData = fragments[otherId]
+            if otherData["partIndex"] != objectData["partIndex"] and boxesTouch(objectData["boundingBox"], otherData["boundingBox"]):
+                parents[findRoot(fragmentId)] = findRoot(otherId)
+        addToGrid(fragmentGrid, fragmentId, gridSize, objectData["boundingBox"])
+
+    groups = {}
+    for fragmentId, objectData in enumerate(fragments):
+        groups.setdefault(findRoot(fragmentId), []).append(objectData)
+
+    # Окно пересчёта выравнивается по контрасту иначе, чем части, и вплотную стоящие объекты в нём могут слиться;
+    # такой контур больше уже найденного объекта и почти целиком лежит на нём, поэтому не добавляется.
+    for group in groups.values():
+        for objectData in measureMergedObject(imageState, group, imageParts):
+            box = objectData["boundingBox"]
+            if not any(duplicateObject(box, otherData["boundingBox"]) or gluedTo(box, otherData["boundingBox"])
+                       for otherData in nearbyObjects(keptObjects, box, gridSize)):
+                addToGrid(keptObjects, objectData, gridSize)
+                objectsData.append(objectData)
+
+    objectsData.sort(key=lambda objectData: objectData["partIndex"])
+    return objectsData
+
+def measureMergedObject(imageState, fragments, imageParts):
+    # Объект больше ореола обрезан во всех частях, поэтому он измеряется заново по окну вокруг
+    # объединённой рамки кусков. В группу могли попасть куски нескольких соприкасающихся объектов, так что
+    # возвращаются все найденные в окне контуры, накрывающие хотя бы один кусок, а не один самый крупный.
+    imageSource = imageState["imageSource"]
+    imageHeight, imageWidth = imageSource["shape"][:2]
+    x, y, boxWidth, boxHeight = joinBoxes(objectData["boundingBox"] for objectData in fragments)
+    margin = max(boxWidth, boxHeight) // 4 + 8
+    offsetX, offsetY = max(x - margin, 0), max(y - margin, 0)
+    windowWidth = min(x + boxWidth + margin, imageWidth) - offsetX
+    windowHeight = min(y + boxHeight + margin, imageHeight) - offsetY
+
+    image, sharedImage = attachImage(imageSource)
+    try:
+        window = readImageWindow(image, imageSource, offsetX, offsetY, windowWidth, windowHeight)
+        candidates = detectObjects(window, fragments[0]["partIndex"], imageState["imageName"], offsetX, offsetY,
+                                   imageState["measurement"])
+    finally:
+        image = window = None
+        if sharedImage is not None:
+            sharedImage.close()
+
+    mergedObjects = []
+    for objectData in candidates:
+        box = objectData["boundingBox"]
+        if any(boxInside(fragment["boundingBox"], box) for fragment in fragments):
+            # Объект достаётся части, в чьё ядро попал его центр, как и объекты, найденные целиком.
+            ownerIndex = ownerPart(objectData["coordinates"], imageParts)
+            if ownerIndex is not None:
+                objectData["partIndex"] = ownerIndex
+            mergedObjects.append(objectData)
+    return mergedObjects
+
+def addToGrid(grid, item, gridSize, box=None):
+    x, y, boxWidth, boxHeight = box if box is not None else item["boundingBox"]
+    for cellY in range(y // gridSize, (y + boxHeight) // gridSize + 1):
+        for cellX in range(x // gridSize, (x + boxWidth) // gridSize + 1):
+            grid.setdefault((cellX, cellY), []).append(item)
+
+def nearbyObjects(grid, box, gridSize):
+    # Всё, что лежит в ячейках сетки под рамкой; элемент может встретиться несколько раз.
+    x, y, boxWidth, boxHeight = box
+    for cellY in range(y // gridSize, (y + boxHeight) // gridSize + 1):
+        for cellX in range(x // gridSize, (x + boxWidth) // gridSize + 1):
+            yield from grid.get((cellX, cellY), ())
+
+def ownerPart(coordinates, imageParts):
+    centerX, centerY = coordinates
+    for partIndex, (_, _, _, _, _, (coreX, coreY, coreWidth, coreHeight)) in imageParts.items():
+        if coreX <= centerX < coreX + coreWidth and coreY <= centerY < coreY + coreHeight:
+            return partIndex
+    return None
+
+def boxesTouch(firstBox, secondBox):
+    firstX, firstY, firstWidth, firstHeight = firstBox
+    secondX, secondY, secondWidth, secondHeight = secondBox
+    return (firstX <= secondX + secondWidth and secondX <= firstX + firstWidth and
+            firstY <= secondY + secondHeight and secondY <= firstY + firstHeight)
+
+def sameObject(firstBox, secondBox, tolerance=2):
+    # Копии одного объекта из разных частей почти совпадают, но выравнивание контраста по части может сдвинуть
+    # границу мелкого объекта на пиксель-другой, поэтому рамки сравниваются по центру и размеру с допуском.
+    firstX, firstY, firstWidth, firstHeight = firstBox
+    secondX, secondY, secondWidth, secondHeight = secondBox
+    return (abs(2 * firstX + firstWidth - 2 * secondX - secondWidth) <= 2 * tolerance and
+            abs(2 * firstY + firstHeight - 2 * secondY - secondHeight) <= 2 * tolerance and
+            abs(firstWidth - secondWidth) <= 2 * tolerance and abs(firstHeight - secondHeight) <= 2 * tolerance)
+
+def duplicateObject(firstBox, secondBox, minimumOverlap=0.3):
+    # Рамки разных объектов на одном снимке почти не перекрываются, а рамки одного объекта, по-разному
+    # выделенного в соседних частях, перекрываются заметно, даже когда одна из них вдвое меньше другой.
+    if sameObject(firstBox, secondBox):
+        return True
+    intersection = intersectionArea(firstBox, secondBox)
+    union = firstBox[2] * firstBox[3] + secondBox[2] * secondBox[3] - intersection
+    return intersection >= minimumOverlap * union
+
+def gluedTo(box, keptBox):
+    boxArea = box[2] * box[3]
+    return boxArea >= keptBox[2] * keptBox[3] and 2 * intersectionArea(box, keptBox) >= boxArea
+
+def boxInside(innerBox, outerBox, tolerance=2):
+    innerX, innerY, innerWidth, innerHeight = innerBox
+    outerX, outerY, outerWidth, outerHeight = outerBox
+    return (innerX >= outerX - tolerance and innerY >= outerY - tolerance and
+            innerX + innerWidth <= outerX + outerWidth + tolerance and
+            innerY + innerHeight <= outerY + outerHeight + tolerance)
+
+def intersectionArea(firstBox, secondBox):
+    firstX, firstY, firstWidth, firstHeight = firstBox
+    secondX, secondY, secondWidth, secondHeight = secondBox
+    width = min(firstX + firstWidth, secondX + secondWidth) - max(firstX, secondX)
+    height = min(firstY + firstHeight, secondY + secondHeight) - max(firstY, secondY)
+    return max(width, 0) * max(height, 0)
+
+def joinBoxes(boxes):
+    left, top, right, bottom = None, None, None, None
+    for x, y, boxWidth, boxHeight in boxes:
+        left = x if left is None else min(left, x)
+        top = y if top is None else min(top, y)
+        right = x + boxWidth if right is None else max(right, x + boxWidth)
+        bottom = y + boxHeight if bottom is None else max(bottom, y + boxHeight)
+    return (left, top, right - left, bottom - top)
 
 def selectOutputDirectory():
     outputDirectory = filedialog.askdirectory()
@@ -131,15 +696,23 @@ def selectInputDirectory():
     inputDirEntry.delete(0, tk.END)
     inputDirEntry.insert(0, inputDirectory)
 
-def splitImage(image, partSize=1000):
-    imageHeight, imageWidth, _ = image.shape
+def splitImage(imageShape, partSize=1000, overlap=0):
+    imageHeight, imageWidth = imageShape[:2]
     imageParts = []
     
     partIndex = 0
-    for offsetY in range(0, imageHeight, partSize):
-        for offsetX in range(0, imageWidth, partSize):
-            part = image[offsetY:offsetY + partSize, offsetX:offsetX + partSize]
-            imageParts.append((part, offsetX, offsetY, partIndex))
+    for coreY in range(0, imageHeight, partSize):
+        for coreX in range(0, imageWidth, partSize):
+            coreWidth = min(partSize, imageWidth - coreX)
+            coreHeight = min(partSize, imageHeight - coreY)
+
+            # Часть расширяется ореолом overlap, а объекты достаются той части, в чьё ядро попал их центр.
+            offsetX = max(coreX - overlap, 0)
+            offsetY = max(coreY - overlap, 0)
+            partWidth = min(coreX + coreWidth + overlap, imageWidth) - offsetX
+            partHeight = min(coreY + coreHeight + overlap, imageHeight) - offsetY
+            imageParts.append((offsetX, offsetY, partWidth, partHeight, partIndex,
+                               (coreX, coreY, coreWidth, coreHeight)))
             partIndex += 1
     
     return imageParts
@@ -154,7 +727,53 @@ def startProcessing():
         return
 
     statusText.delete(1.0, tk.END)
-    processAllImages(inputDirectory, outputDirectory, outputCSVPath, statusText)
+    progressBar["value"] = 0
+    progressLabel.config(text="")
+    processButton.config(state=tk.DISABLED)
+    cancelButton.config(state=tk.NORMAL)
+    cancelEvent.clear()
+
+    # Анализ идёт в фоновом потоке, а окно забирает сообщения из очереди и не зависает.
+    processingThread = threading.Thread(target=runProcessing, daemon=True,
+                                        args=(inputDirectory, outputDirectory, outputCSVPath, annotateVar.get()))
+    processingThread.start()
+    app.after(100, pollProgress)
+
+def runProcessing(inputDirectory, outputDirectory, outputCSVPath, annotate):
+    report = lambda kind, value: progressQueue.put((kind, value))
+    try:
+        processAllImages(inputDirectory, outputDirectory, outputCSVPath, report, cancelEvent=cancelEvent, annotate=annotate)
+    except Exception as error:
+        report("message", f"Error: {error}")
+    finally:
+        report("done", None)
+
+def pollProgress():
+    while True:
+        try:
+            kind, value = progressQueue.get_nowait()
+        except queue.Empty:
+            break
+
+        if kind == "message":
+            statusText.insert(tk.END, value + "\n")
+            statusText.see(tk.END)
+        elif kind == "progress":
+            progressBar["value"] = value["fraction"] * 100
+            eta = f"{value['etaSeconds']:.0f} s" if value["etaSeconds"] is not None else "?"
+            progressLabel.config(text=f"{value['imagesDone']}/{value['imageCount']} images, "
+                                      f"{value['tilesPerSecond']:.1f} tiles/s, "
+                                      f"{value['megabytesPerSecond']:.1f} MB/s, ETA {eta}")
+        elif kind == "done":
+            processButton.config(state=tk.NORMAL)
+            cancelButton.config(state=tk.DISABLED)
+            return
+
+    app.after(100, pollProgress)
+
+def cancelProcessing():
+    cancelEvent.set()
+    cancelButton.config(state=tk.DISABLED)
 
 if __name__ == "__main__":
     app = tk.Tk()
@@ -179,8 +798,21 @@ if __name__ == "__main__":
 
     processButton = tk.Button(app, text="Process Images", command=startProcessing)
     processButton.grid(row=2, column=1, pady=5)
+    cancelButton = tk.Button(app, text="Cancel", command=cancelProcessing, state=tk.DISABLED)
+    cancelButton.grid(row=2, column=0, padx=10, pady=5)
+    annotateVar = tk.BooleanVar(value=True)
+    annotateCheck = tk.Checkbutton(app, text="Save annotated parts", variable=annotateVar)
+    annotateCheck.grid(row=2, column=2, padx=10, pady=5)
 
     statusText = Text(app, height=10, width=70)
     statusText.grid(row=3, column=0, columnspan=3, padx=10, pady=10, sticky="nsew")
 
+    progressBar = ttk.Progressbar(app, maximum=100)
+    progressBar.grid(row=4, column=0, columnspan=3, padx=10, sticky="we")
+    progressLabel = tk.Label(app, text="")
+    progressLabel.grid(row=5, column=0, columnspan=3, padx=10, pady=5)
+
+    progressQueue = queue.Queue()
+    cancelEvent = threading.Event()
+
     app.mainloop()
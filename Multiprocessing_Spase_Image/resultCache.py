@@ -0,0 +1,70 @@
+import hashlib
+import json
+import os
+import threading
+
+class ResultCache:
+    # Результаты хранятся по ключу «хеш содержимого файла + хеш параметров анализа»,
+    # так что переименованный файл берётся из кэша, а смена порога или размера части сбрасывает его.
+    def __init__(self, cacheDirectory, parameters):
+        self.cacheDirectory = cacheDirectory
+        self.parametersKey = hashlib.sha256(json.dumps(parameters, sort_keys=True).encode("utf-8")).hexdigest()[:16]
+        self.indexPath = os.path.join(cacheDirectory, "index.json")
+        self.lock = threading.Lock()
+
+        os.makedirs(cacheDirectory, exist_ok=True)
+        try:
+            with open(self.indexPath, encoding="utf-8") as indexFile:
+                self.index = json.load(indexFile)
+        except (OSError, ValueError):
+            self.index = {}
+
+    def key(self, imagePath):
+        # Хеш пересчитывается, только если у файла поменялись размер или время изменения.
+        fileStat = os.stat(imagePath)
+        indexKey = os.path.abspath(imagePath)
+        with self.lock:
+            entry = self.index.get(indexKey)
+        if entry is not None and entry[:2] == [fileStat.st_size, fileStat.st_mtime_ns]:
+            digest = entry[2]
+        else:
+            digest = fileDigest(imagePath)
+            with self.lock:
+                self.index[indexKey] = [fileStat.st_size, fileStat.st_mtime_ns, digest]
+
+        return f"{digest}_{self.parametersKey}"
+
+    def get(self, cacheKey, imageName):
+        try:
+            with open(os.path.join(self.cacheDirectory, cacheKey + ".json"), encoding="utf-8") as cacheFile:
+                objectsData = json.load(cacheFile)
+        except (OSError, ValueError):
+            return None
+
+        for objectData in objectsData:
+            objectData["imageName"] = imageName
+            objectData["coordinates"] = tuple(objectData["coordinates"])
+            objectData["boundingBox"] = tuple(objectData["boundingBox"])
+        return objectsData
+
+    def put(self, cacheKey, objectsData):
+        writeJson(os.path.join(self.cacheDirectory, cacheKey + ".json"), objectsData)
+
+    def save(self):
+        with self.lock:
+            index = dict(self.index)
+        writeJson(self.indexPath, index)
+
+def fileDigest(path, blockSize=1 << 20):
+    digest = hashlib.sha256()
+    with open(path, "rb") as file:
+        for block in iter(lambda: file.read(blockSize), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+def writeJson(path, value):
+    # Запись через временный файл, чтобы прерванный прогон не оставил в кэше обрезанный JSON.
+    temporaryPath = f"{path}.{os.getpid()}.tmp"
+    with open(temporaryPath, "w", encoding="utf-8") as file:
+        json.dump(value, file, default=lambda number: number.item())
+    os.replace(temporaryPath, path)
@@ -0,0 +1,139 @@
+import csv
+import glob
+import numpy
+import os
+import re
+
+try:
+    import pyarrow
+    import pyarrow.parquet
+except ImportError:
+    pyarrow = None
+
+columnNames = ['imageName', 'partIndex', 'x', 'y', 'brightness', 'area', 'type', 'size']
+columnTypes = {'partIndex': numpy.int32, 'x': numpy.int64, 'y': numpy.int64, 'brightness': numpy.int64,
+               'area': numpy.float64, 'size': numpy.int64}
+
+def removeNumberedFiles(outputPath, suffix, extension):
+    # Порции прошлого запуска с тем же именем читатель подхватил бы вместе с новыми, поэтому они удаляются
+    # при открытии, как CSV перезаписывается целиком.
+    base, _ = os.path.splitext(outputPath)
+    pattern = re.compile(re.escape(os.path.basename(base) + suffix) + r"\d{4,}" + re.escape(extension) + "$")
+    for path in glob.glob(glob.escape(base + suffix) + "*" + extension):
+        if pattern.match(os.path.basename(path)):
+            os.remove(path)
+
+class CsvResultWriter:
+    def __init__(self, outputPath):
+        self.outputPath = outputPath
+        self.csvFile = open(outputPath, mode='w', newline='')
+
+        fieldnames = ['imageName', 'partIndex', 'coordinates', 'brightness', 'area', 'type', 'size']
+        self.csvWriter = csv.DictWriter(self.csvFile, fieldnames=fieldnames)
+        self.csvWriter.writeheader()
+
+    def write(self, objectsData):
+        for objectData in objectsData:
+            self.csvWriter.writerow({
+                'imageName': objectData['imageName'],
+                'partIndex': objectData['partIndex'],
+                'coordinates': objectData['coordinates'],
+                'brightness': objectData['brightness'],
+                'area': objectData['area'],
+                'type': objectData['type'],
+                'size': objectData['size']
+            })
+
+    def flush(self):
+        self.csvFile.flush()
+
+    def close(self):
+        self.csvFile.close()
+
+class ColumnarResultWriter:
+    # Строки копятся до chunkSize и сбрасываются колонками, поэтому память не растёт с числом объектов.
+    def __init__(self, outputPath, chunkSize=100000):
+        self.outputPath = outputPath
+        self.chunkSize = chunkSize
+        self.columns = {name: [] for name in columnNames}
+        self.rowCount = 0
+
+    def write(self, objectsData):
+        for objectData in objectsData:
+            self.columns['imageName'].append(objectData['imageName'])
+            self.columns['partIndex'].append(objectData['partIndex'])
+            self.columns['x'].append(objectData['coordinates'][0])
+            self.columns['y'].append(objectData['coordinates'][1])
+            self.columns['brightness'].append(objectData['brightness'])
+            self.columns['area'].append(objectData['area'])
+            self.columns['type'].append(objectData['type'])
+            self.columns['size'].append(objectData['size'])
+
+        self.rowCount += len(objectsData)
+        if self.rowCount >= self.chunkSize:
+            self.writeBuffered()
+
+    def writeBuffered(self):
+        if not self.rowCount:
+            return
+
+        chunk = {name: numpy.asarray(values, dtype=columnTypes.get(name, str)) for name, values in self.columns.items()}
+        self.writeChunk(chunk)
+
+        for values in self.columns.values():
+            values.clear()
+        self.rowCount = 0
+
+    def flush(self):
+        self.writeBuffered()
+
+    def close(self):
+        self.flush()
+
+class NpzResultWriter(ColumnarResultWriter):
+    def __init__(self, outputPath, chunkSize=100000):
+        super().__init__(outputPath, chunkSize)
+        self.chunkIndex = 0
+        removeNumberedFiles(outputPath, "_chunk", ".npz")
+
+    def writeChunk(self, chunk):
+        # Каждая порция пишется отдельным файлом base_chunk0000.npz с массивом на колонку.
+        base, _ = os.path.splitext(self.outputPath)
+        numpy.savez(f"{base}_chunk{self.chunkIndex:04d}.npz", **chunk)
+        self.chunkIndex += 1
+
+class ParquetResultWriter(ColumnarResultWriter):
+    def __init__(self, outputPath, chunkSize=100000):
+        if pyarrow is None:
+            raise RuntimeError("Parquet output requires pyarrow to be installed.")
+
+        super().__init__(outputPath, chunkSize)
+        self.parquetWriter = None
+        self.partIndex = 0
+        removeNumberedFiles(outputPath, "_part", ".parquet")
+
+    def writeChunk(self, chunk):
+        table = pyarrow.table(chunk)
+        if self.parquetWriter is None:
+            base, _ = os.path.splitext(self.outputPath)
+            partPath = self.outputPath if self.partIndex == 0 else f"{base}_part{self.partIndex:04d}.parquet"
+            self.parquetWriter = pyarrow.parquet.ParquetWriter(partPath, table.schema)
+        self.parquetWriter.write_table(table)
+
+    def flush(self):
+        # Файл Parquet читается только после записи футера при закрытии. В режиме наблюдения flush вызывается
+        # после каждой пачки изображений, поэтому текущий файл закрывается, а следующие строки идут
+        # в base_part0001.parquet и дальше; за один проход без flush получается один файл outputPath.
+        super().flush()
+        if self.parquetWriter is not None:
+            self.parquetWriter.close()
+            self.parquetWriter = None
+            self.partIndex += 1
+
+def openResultWriter(outputPath):
+    extension = os.path.splitext(outputPath)[1].lower()
+    if extension == '.parquet':
+        return ParquetResultWriter(outputPath)
+    if extension == '.npz':
+        return NpzResultWriter(outputPath)
+    return CsvResultWriter(outputPath)
@@ -0,0 +1,78 @@
+import os
+import time
+from contextlib import contextmanager
+
+profilingEnabled = False
+stageTimings = None
+
+def enableProfiling():
+    global profilingEnabled
+    profilingEnabled = True
+
+def startTile():
+    global stageTimings
+    if profilingEnabled:
+        stageTimings = {"startTime": time.perf_counter()}
+
+def finishTile():
+    global stageTimings
+    if stageTimings is None:
+        return None
+
+    tileTimings = stageTimings
+    stageTimings = None
+    tileTimings["total"] = time.perf_counter() - tileTimings.pop("startTime")
+    tileTimings["worker"] = os.getpid()
+    return tileTimings
+
+def isTimingTile():
+    return stageTimings is not None
+
+@contextmanager
+def timedStage(stageName):
+    if stageTimings is None:
+        yield
+        return
+
+    startTime = time.perf_counter()
+    try:
+        yield
+    finally:
+        stageTimings[stageName] = stageTimings.get(stageName, 0.0) + time.perf_counter() - startTime
+
+class StageProfile:
+    # Время стадий суммируется по всем частям прогона, а queueAndTransfer — это путь части от отправки
+    # в пул до возврата результата за вычетом работы воркера, то есть ожидание в очереди пула и передача данных.
+    def __init__(self):
+        self.tileCount = 0
+        self.stageSeconds = {}
+        self.workers = {}
+        self.queueAndTransferSeconds = 0.0
+
+    def add(self, tileTimings, roundTripSeconds):
+        tileTimings = dict(tileTimings)
+        worker = tileTimings.pop("worker")
+        totalSeconds = tileTimings.pop("total")
+
+        self.tileCount += 1
+        for stageName, seconds in tileTimings.items():
+            self.stageSeconds[stageName] = self.stageSeconds.get(stageName, 0.0) + seconds
+
+        workerStats = self.workers.setdefault(worker, {"tiles": 0, "busySeconds": 0.0})
+        workerStats["tiles"] += 1
+        workerStats["busySeconds"] += totalSeconds
+        self.queueAndTransferSeconds += max(roundTripSeconds - totalSeconds, 0.0)
+
+    def summary(self):
+        busySeconds = sum(workerStats["busySeconds"] for workerStats in self.workers.values())
+        return {
+            "tiles": self.tileCount,
+            "stages": {stageName: {
+                "totalSeconds": round(seconds, 4),
+                "meanMilliseconds": round(seconds / self.tileCount * 1000, 3),
+                "share": round(seconds / busySeconds, 4) if busySeconds else None
+            } for stageName, seconds in sorted(self.stageSeconds.items(), key=lambda item: -item[1])},
+            "workers": {str(worker): {"tiles": workerStats["tiles"], "busySeconds": round(workerStats["busySeconds"], 4)}
+                        for worker, workerStats in self.workers.items()},
+            "queueAndTransferSeconds": round(self.queueAndTransferSeconds, 4)
+        }
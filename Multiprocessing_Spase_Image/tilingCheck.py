@@ -0,0 +1,122 @@
+import argparse
+import cv2
+import json
+import numpy
+import os
+import sys
+import tempfile
+
+from astroBenchmark import generateStarField
+from multiprocessingSpaseImage import createPool, processImages
+
+def generateDiscField(width, height, discCount, seed=0):
+    # Диски разного радиуса на шумном фоне: многие соприкасаются или сливаются, а крупные больше ореола части.
+    randomGenerator = numpy.random.default_rng(seed)
+    image = randomGenerator.normal(20, 8, (height, width, 3)).clip(0, 255).astype(numpy.uint8)
+    for _ in range(discCount):
+        center = (int(randomGenerator.integers(0, width)), int(randomGenerator.integers(0, height)))
+        radius = int(randomGenerator.integers(4, 45))
+        brightness = int(randomGenerator.integers(150, 255))
+        cv2.circle(image, center, radius, (brightness, brightness, brightness), -1)
+    return image
+
+def detectAll(imagePath, outputDirectory, processPool, partSize, overlap, measurement):
+    for _, objectsData in processImages([imagePath], outputDirectory, processPool, partSize=partSize, overlap=overlap,
+                                        measurement=measurement, annotate=False):
+        return objectsData
+
+def boxOverlaps(firstBoxes, secondBoxes):
+    # Отношение площади пересечения к площади объединения для всех пар рамок сразу.
+    first = numpy.asarray(firstBoxes, dtype=numpy.int64).reshape(-1, 1, 4)
+    second = numpy.asarray(secondBoxes, dtype=numpy.int64).reshape(1, -1, 4)
+    width = numpy.minimum(first[..., 0] + first[..., 2], second[..., 0] + second[..., 2]) - numpy.maximum(first[..., 0], second[..., 0])
+    height = numpy.minimum(first[..., 1] + first[..., 3], second[..., 1] + second[..., 3]) - numpy.maximum(first[..., 1], second[..., 1])
+    intersection = numpy.clip(width, 0, None) * numpy.clip(height, 0, None)
+    union = first[..., 2] * first[..., 3] + second[..., 2] * second[..., 3] - intersection
+    return intersection / union
+
+def compareObjects(referenceObjects, tiledObjects):
+    # Объекты сопоставляются жадно по убыванию перекрытия рамок; несопоставленные считаются потерянными или лишними.
+    # Выравнивание контраста идёт по каждой части отдельно, поэтому рамка мелкого объекта может сдвинуться
+    # на пиксель, и достаточно любого пересечения.
+    if not referenceObjects or not tiledObjects:
+        return len(referenceObjects), len(tiledObjects)
+
+    overlaps = boxOverlaps([objectData["boundingBox"] for objectData in referenceObjects],
+                           [objectData["boundingBox"] for objectData in tiledObjects])
+    matchedReference, matchedTiled = set(), set()
+    for referenceId, tiledId in zip(*numpy.unravel_index(numpy.argsort(-overlaps, axis=None), overlaps.shape)):
+        if overlaps[referenceId, tiledId] <= 0:
+            break
+        if referenceId not in matchedReference and tiledId not in matchedTiled:
+            matchedReference.add(referenceId)
+            matchedTiled.add(tiledId)
+
+    return len(referenceObjects) - len(matchedReference), len(tiledObjects) - len(matchedTiled)
+
+def countDuplicates(objectsData, minimumOverlap=0.3):
+    # Пары заметно перекрывающихся рамок: на одном снимке разные объекты так почти не лежат,
+    # так что каждая лишняя пара — один объект, выделенный дважды в соседних частях.
+    if len(objectsData) < 2:
+        return 0
+    boxes = [objectData["boundingBox"] for objectData in objectsData]
+    return int(numpy.count_nonzero(numpy.triu(boxOverlaps(boxes, boxes) > minimumOverlap, 1)))
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Compares tiled analysis with a single-tile run of the same synthetic images.")
+    parser.add_argument("--width", type=int, default=2000)
+    parser.add_argument("--height", type=int, default=1500)
+    parser.add_argument("--images", type=int, default=3)
+    parser.add_argument("--discs", type=int, default=600)
+    parser.add_argument("--starsPerMegapixel", type=int, default=2000,
+                        help="density of the star field checked for duplicates; 0 skips it")
+    parser.add_argument("--partSizes", type=int, nargs="+", default=[200, 250, 500])
+    parser.add_argument("--overlaps", type=int, nargs="+", default=[0, 64])
+    parser.add_argument("--measurement", choices=["contours", "components"], default="contours")
+    parser.add_argument("--processes", type=int, default=None)
+    parser.add_argument("--tolerance", type=float, default=0.02,
+                        help="allowed fraction of lost or extra objects per configuration")
+    parser.add_argument("--seed", type=int, default=0)
+    arguments = parser.parse_args()
+
+    failed = False
+    processPool = createPool(arguments.processes)
+    try:
+        with tempfile.TemporaryDirectory() as workDirectory:
+            for imageIndex in range(arguments.images):
+                fields = [("discs", generateDiscField(arguments.width, arguments.height, arguments.discs,
+                                                      arguments.seed + imageIndex))]
+                if arguments.starsPerMegapixel:
+                    fields.append(("stars", generateStarField(arguments.width, arguments.height, arguments.starsPerMegapixel,
+                                                              seed=arguments.seed + imageIndex)))
+
+                for field, image in fields:
+                    imagePath = os.path.join(workDirectory, f"{field}{imageIndex}.png")
+                    cv2.imwrite(imagePath, image)
+
+                    # Эталон — одна часть на всё изображение, где склейка по границам частей не участвует.
+                    referenceObjects = detectAll(imagePath, workDirectory, processPool,
+                                                 max(arguments.width, arguments.height), 0, arguments.measurement)
+                    referenceDuplicates = countDuplicates(referenceObjects)
+
+                    for partSize in arguments.partSizes:
+                        for overlap in arguments.overlaps:
+                            tiledObjects = detectAll(imagePath, workDirectory, processPool, partSize, overlap,
+                                                     arguments.measurement)
+                            lost, extra = compareObjects(referenceObjects, tiledObjects)
+                            duplicates = max(countDuplicates(tiledObjects) - referenceDuplicates, 0)
+                            # Полностью совпасть с эталоном разбиение не обязано: контраст выравнивается по каждой части,
+                            # и вплотную стоящие объекты в одной из них могут слиться в один. На звёздном поле то же
+                            # выравнивание решает судьбу сотен слабых звёзд у порога, поэтому там проверяются только дубли.
+                            passed = duplicates == 0 and (field == "stars" or
+                                                          max(lost, extra) <= arguments.tolerance * len(referenceObjects))
+                            failed = failed or not passed
+                            print(json.dumps({"image": imageIndex, "field": field, "partSize": partSize, "overlap": overlap,
+                                              "reference": len(referenceObjects), "tiled": len(tiledObjects),
+                                              "lost": lost, "extra": extra, "duplicates": duplicates, "passed": passed}))
+        processPool.close()
+        processPool.join()
+    finally:
+        processPool.terminate()
+
+    sys.exit(1 if failed else 0)